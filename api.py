@@ -0,0 +1,508 @@
+import asyncio
+import base64
+import json
+import logging
+from datetime import date, datetime, timedelta
+
+import columnar
+import db
+import metrics
+import queries
+import rollup
+import sales_engine
+from trends import evaluate_trends, fit_trends_cached, pad_series
+
+# The /api/sales/* endpoints, independent of the server that answers them: app.py serves them with Flask
+# and asgi.py natively on one event loop. Each takes the query parameters (a werkzeug MultiDict) and returns
+# what a view returns: a dict or list, a (body, status) tuple, or a Body / Stream below.
+
+# Upper bound for one page of /api/sales/fetch-sales
+MAX_SALES_PAGE_SIZE = 5000
+
+
+class Body:
+    """A response body that is already encoded, e.g. a JSON document built by Postgres."""
+
+    def __init__(self, content, mimetype):
+        self.content = content
+        self.mimetype = mimetype
+
+
+class Stream:
+    """A response body encoded one cursor batch of queries.SALES_ROWS at a time."""
+
+    def __init__(self, encoder, filters, mimetype, headers=None):
+        self.encoder = encoder
+        self.filters = filters
+        self.mimetype = mimetype
+        self.headers = headers or {}
+
+    def chunks(self):
+        """The body as a blocking generator, for WSGI servers."""
+        for rows in queries.iterate(queries.SALES_ROWS, batch_size=self.encoder.batch_size, **self.filters):
+            yield self.encoder.encode(rows)
+        yield self.encoder.finish()
+
+    async def achunks(self):
+        """The body as an async generator on the loop that owns the pool; batches are encoded off the loop."""
+        async for rows in queries.batches(queries.SALES_ROWS, batch_size=self.encoder.batch_size, **self.filters):
+            yield await asyncio.to_thread(self.encoder.encode, rows)
+        yield self.encoder.finish()
+
+
+#T1. Fetch sales trend and estimate sales trend when applying for discounts
+async def sales_trend(args):
+    try:
+        # Validate and parse query parameters
+        start_date = args.get("startDate")
+        end_date = args.get("endDate")
+        gender = args.get("gender", "All")
+        min_age = args.get("ageMin")
+        max_age = args.get("ageMax")
+        city = args.get("city", "All")
+        trend_type = args.get("trendType", "linear")
+        frequency = args.get("frequency", "Daily").capitalize()  # Normalize capitalization
+        prediction_points = int(args.get("predictionPoints", 0))
+
+        # Ensure required parameters are present
+        if not start_date or not end_date:
+            return {"error": "startDate and endDate are required."}, 400
+
+        try:
+            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+            if start_date > end_date:
+                return {"error": "startDate must be before endDate."}, 400
+        except ValueError:
+            return {"error": "Invalid date format. Use YYYY-MM-DD."}, 400
+
+        # Handle min_age and max_age with default to None
+        min_age = int(min_age) if min_age and min_age.isdigit() else None
+        max_age = int(max_age) if max_age and max_age.isdigit() else None
+
+        # Validate frequency
+        valid_frequencies = {"Daily": "day", "Monthly": "month", "Yearly": "year"}
+        if frequency not in valid_frequencies:
+            return {"error": f"Invalid frequency. Choose from {list(valid_frequencies.keys())}."}, 400
+
+        # Read from memory or the daily rollup when the filters allow it
+        statement = queries.ROLLUP_DISCOUNT_SALES if await rollup.can_answer(min_age, max_age) else queries.DISCOUNT_SALES
+        result = await sales_engine.fetch(
+            statement,
+            unit=valid_frequencies[frequency],
+            start_date=start_date,
+            end_date=end_date,
+            gender=queries.filter_value(gender),
+            min_age=min_age,
+            max_age=max_age,
+            city=queries.filter_value(city),
+        )
+
+        if not result:
+            return {"error": "No sales data found with discounts for the specified range."}, 404
+
+        # One processing stage per request, with the fitting nested in it and also timed on its own
+        with metrics.stage("processing"):
+            # Prepare sales data, grouped by discount
+            sales_data = {}
+            for row in result:
+                discount = float(row["discount_rate"])
+                friendly_name = row["discount_name"] + ": " + str(discount)
+                sale_date = row["period"].strftime("%Y-%m-%d")
+                total_sales = float(row["total_sales"])
+                if discount not in sales_data:
+                    sales_data[discount] = {"dates": [], "sales": []}
+                sales_data[discount]["dates"].append(sale_date)
+                sales_data[discount]["sales"].append(total_sales)
+
+            # Prepare trend data (optional): every discount series is fitted in one batch
+            trend_data = {}
+            discounts = list(sales_data.keys())
+            if trend_type and prediction_points > 0 and discounts:
+                y_data, lengths = pad_series([sales_data[discount]["sales"] for discount in discounts])
+                with metrics.stage("fitting"):
+                    fit = fit_trends_cached(y_data, lengths, trend_type, frequency)
+                    trend_lines, future_trends = evaluate_trends(fit, prediction_points)
+                logging.debug(f"Fitted {len(discounts)} {trend_type} trends: {dict(zip(discounts, fit.methods))}")
+
+            for i, friendly_name in enumerate(discounts):
+                data = sales_data[friendly_name]
+                trend_line = []
+                future_trend = []
+                fit_method = None
+                if trend_type and prediction_points > 0:
+                    trend_line = trend_lines[i, :lengths[i]].tolist()
+                    future_trend = future_trends[i, :lengths[i] + prediction_points].tolist()
+                    fit_method = fit.methods[i]
+
+                future_dates = [(end_date + timedelta(days=day)).strftime("%Y-%m-%d") for day in range(len(future_trend))]
+                trend_data[friendly_name] = {
+                    "trend": [{"date": date, "trend_value": value} for date, value in zip(data["dates"], trend_line)] if any(trend_line) else [],
+                    "future_trend": [
+                        {"date": date, "trend_value": value} for date, value in zip(future_dates, future_trend)
+                    ] if any(future_trend) else [],
+                    "fit_method": fit_method
+                }
+
+        return {"trend_data": trend_data}
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return {"error": f"An error occurred while processing the request: {e}"}, 500
+
+
+#2. Convert a raw sales row into the fetch-sales response shape
+def sale_row_to_dict(row):
+    return {
+        "sale_id": row["sale_id"],
+        "book_title": row["title"],
+        "age_group": row["age_group_name"],
+        "age_group_description": row["description"],
+        "age": row["age"],
+        "gender": row["gender"],
+        "sale_date": row["sale_date"].strftime("%Y-%m-%d"),
+        "quantity": row["quantity"],
+        "total_sales": row["total_sales"],
+        "category": row["category_name"],
+        "city": row["city_name"],
+    }
+
+
+#2. Parameters of queries.SALES_ROWS for the fetch-sales filters
+def sales_rows_filters(start_date, end_date, gender="All", min_age=None, max_age=None, city="All"):
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "gender": queries.filter_value(gender),
+        "min_age": min_age,
+        "max_age": max_age,
+        "city": queries.filter_value(city),
+    }
+
+
+#2. Encode sales rows as NDJSON, one cursor batch per chunk
+class NDJSONEncoder:
+    batch_size = db.CURSOR_BATCH_SIZE
+
+    def encode(self, rows):
+        # Encoded like the servers' JSON responses: sorted keys, Decimals as strings
+        return "".join(json.dumps(sale_row_to_dict(row), default=str, sort_keys=True) + "\n" for row in rows)
+
+    def finish(self):
+        return ""
+
+
+#2. Opaque keyset cursor for fetch-sales pagination: the (sale_date, sale_id) of the last row sent
+def encode_sales_cursor(row):
+    key = json.dumps([row["sale_date"].isoformat(), row["sale_id"]])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_sales_cursor(token):
+    try:
+        sale_date, sale_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return date.fromisoformat(sale_date), int(sale_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+
+
+#2. Fetch sales
+async def sales(args):
+    try:
+        # Validate and parse query parameters
+        start_date = args.get("startDate")
+        end_date = args.get("endDate")
+        gender = args.get("gender", "All")
+        min_age = args.get("minAge")
+        max_age = args.get("maxAge")
+        city = args.get("city", "All")
+        response_format = args.get("format", "json").lower()
+        page_size = args.get("pageSize")
+        cursor = args.get("cursor")
+
+        # Ensure required parameters are present
+        if not start_date or not end_date:
+            return {"error": "startDate and endDate are required."}, 400
+
+        try:
+            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+            if start_date > end_date:
+                return {"error": "startDate must be before endDate."}, 400
+        except ValueError:
+            return {"error": "Invalid date format. Use YYYY-MM-DD."}, 400
+
+        if response_format not in ("json", "ndjson"):
+            return {"error": "Invalid format. Choose from ['json', 'ndjson']."}, 400
+
+        # Keyset pagination: pageSize rows per call, continuing after the cursor row
+        if page_size is not None:
+            if response_format == "ndjson":
+                return {"error": "pageSize is not supported with format=ndjson."}, 400
+            if not page_size.isdigit() or not 1 <= int(page_size) <= MAX_SALES_PAGE_SIZE:
+                return {"error": f"pageSize must be between 1 and {MAX_SALES_PAGE_SIZE}."}, 400
+            page_size = int(page_size)
+            try:
+                after = decode_sales_cursor(cursor) if cursor else None
+            except ValueError as e:
+                return {"error": str(e)}, 400
+
+        min_age = int(min_age) if min_age else None
+        max_age = int(max_age) if max_age else None
+
+        # Execute query
+        filters = sales_rows_filters(start_date, end_date, gender, min_age, max_age, city)
+
+        if page_size is not None:
+            if after is not None:
+                filters["after_date"], filters["after_id"] = after
+            # One extra row tells us whether another page exists
+            result = await queries.fetch(queries.SALES_ROWS, limit=page_size + 1, **filters)
+            page = result[:page_size]
+            next_cursor = encode_sales_cursor(page[-1]) if len(result) > page_size else None
+            with metrics.stage("processing"):
+                data = [sale_row_to_dict(row) for row in page]
+            return {"data": data, "nextCursor": next_cursor}
+
+        # Stream one JSON object per line straight off a server-side cursor
+        if response_format == "ndjson":
+            return Stream(NDJSONEncoder(), filters, "application/x-ndjson")
+
+        result = await queries.fetch(queries.SALES_ROWS, **filters)
+
+        if not result:
+            return {"error": "No sales data found for the specified range."}, 404
+
+        # Prepare the response data with additional details
+        with metrics.stage("processing"):
+            sales_data = [sale_row_to_dict(row) for row in result]
+
+        # Return sales data (for the fetch-sales endpoint)
+        return {"data": sales_data}
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return {"error": f"An error occurred while processing the request: {e}"}, 500
+
+
+#2. Export raw sales rows as streamed CSV, Parquet or Arrow IPC
+async def sales_data_export(args):
+    try:
+        # Validate and parse query parameters
+        start_date = args.get("startDate")
+        end_date = args.get("endDate")
+        gender = args.get("gender", "All")
+        min_age = args.get("minAge")
+        max_age = args.get("maxAge")
+        city = args.get("city", "All")
+        file_format = args.get("format", "csv").lower()
+
+        # Ensure required parameters are present
+        if not start_date or not end_date:
+            return {"error": "startDate and endDate are required."}, 400
+
+        try:
+            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+            if start_date > end_date:
+                return {"error": "startDate must be before endDate."}, 400
+        except ValueError:
+            return {"error": "Invalid date format. Use YYYY-MM-DD."}, 400
+
+        if file_format not in columnar.MIMETYPES:
+            return {"error": f"Invalid format. Choose from {list(columnar.MIMETYPES.keys())}."}, 400
+
+        min_age = int(min_age) if min_age else None
+        max_age = int(max_age) if max_age else None
+
+        filters = sales_rows_filters(start_date, end_date, gender, min_age, max_age, city)
+
+        # Rows are read and encoded one cursor batch at a time
+        extension = "arrows" if file_format == "arrow" else file_format
+        return Stream(
+            columnar.encoder(file_format),
+            filters,
+            columnar.MIMETYPES[file_format],
+            headers={"Content-Disposition": f"attachment; filename=sales_{start_date}_{end_date}.{extension}"}
+        )
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return {"error": f"An error occurred while processing the request: {e}"}, 500
+
+
+#1. Fetch all categories
+async def categories(args):
+    try:
+        # Fetch all categories
+        rows = await queries.fetch(queries.CATEGORIES)
+
+        # Convert rows to a list of dictionaries
+        return [dict(row) for row in rows]
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+#1. Fetch sales per subcategory filtering by category
+async def subcategory_series(args):
+    # Get query parameters
+    gender = args.get("gender", None)
+    age_min = args.get("ageMin", None, type=int)
+    age_max = args.get("ageMax", None, type=int)
+    start_date = args.get("startDate", None)
+    end_date = args.get("endDate", None)
+    category = args.get("category", None, type=int)
+
+    # Validate and parse date inputs
+    if not start_date or not end_date:
+        return {"error": "startDate and endDate are required."}, 400
+
+    try:
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        return {"error": "Invalid date format. Use YYYY-MM-DD."}, 400
+
+    # Execute the query
+    try:
+        # Read from memory or the daily rollup when the filters allow it
+        statement = queries.ROLLUP_SUBCATEGORY_SALES if await rollup.can_answer(age_min, age_max) else queries.SUBCATEGORY_SALES
+        rows = await sales_engine.fetch(
+            statement,
+            start_date=start_date_obj,
+            end_date=end_date_obj,
+            gender=queries.filter_value(gender),
+            min_age=age_min,
+            max_age=age_max,
+            category=queries.filter_value(category),
+        )
+        data = [dict(row) for row in rows]
+        logging.debug(f"Executing query 1: {statement.name}")
+        return data
+    except Exception as e:
+        logging.error(f"Error fetching data: {e}")
+        return {"error": str(e)}, 500
+
+
+#3. Fetch sales data for event linking, filter by category
+async def event_sales(args):
+    try:
+        # Validate and parse query parameters
+        start_date = args.get("startDate")
+        end_date = args.get("endDate")
+        category = args.get("category", None, type=int)
+        gender = args.get("gender", "All")
+
+        # Ensure required parameters are present
+        if not start_date or not end_date:
+            return {"error": "startDate and endDate are required."}, 400
+
+        try:
+            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+            if start_date > end_date:
+                return {"error": "startDate must be before endDate."}, 400
+        except ValueError:
+            return {"error": "Invalid date format. Use YYYY-MM-DD."}, 400
+
+        # Execute query to fetch event data and sales
+        result = await sales_engine.fetch(
+            queries.EVENT_SALES,
+            start_date=start_date,
+            end_date=end_date,
+            category=queries.filter_value(category),
+            gender=queries.filter_value(gender),
+        )
+
+        if not result:
+            return {"error": "No data found for the specified range."}, 404
+
+        # Prepare data for the response
+        with metrics.stage("processing"):
+            event_sales_data = [
+                {
+                    "event_name": row["event_name"],
+                    "category_name": row["category_name"],
+                    "friendly_name": row["category_name"] + " at " + row["event_name"],
+                    "start_date": row["start_date"],
+                    "end_date": row["end_date"],
+                    "duration": int(row["duration"]),
+                    "average_sales_per_day": float(row["average_sales_per_day"]),
+                    "average_books_sold_per_day": int(row["average_books_sold_per_day"]),
+                    "total_sales": float(row["total_sales"]),
+                    "total_quantity_sold": int(row["total_quantity_sold"]),
+                    "unique_books_sold": int(row["unique_books_sold"])
+                }
+                for row in result
+            ]
+
+        return {"data": event_sales_data}
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return {"error": f"An error occurred: {e}"}, 500
+
+
+# Fetch sales data grouped per city
+async def city_sales(args):
+    try:
+        # Parse query parameters
+        start_date = args.get("startDate")
+        end_date = args.get("endDate")
+        gender = args.get("gender", "All")
+        age_min = args.get("ageMin", type=int)
+        age_max = args.get("ageMax", type=int)
+        category = args.get("category", "All")
+
+        if not start_date or not end_date:
+            return {"error": "startDate and endDate are required."}, 400
+
+        try:
+            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+            if start_date > end_date:
+                return {"error": "startDate must be before endDate."}, 400
+        except ValueError:
+            return {"error": "Invalid date format. Use YYYY-MM-DD."}, 400
+
+        # The whole response document is built in memory or by Postgres, from the daily rollup when the filters allow it
+        statement = queries.ROLLUP_CITY_SUMMARY if await rollup.can_answer(age_min, age_max) else queries.CITY_SUMMARY
+        city_data = await sales_engine.fetchval(
+            statement,
+            start_date=start_date,
+            end_date=end_date,
+            gender=queries.filter_value(gender),
+            min_age=age_min,
+            max_age=age_max,
+            category=int(category) if queries.filter_value(category) is not None else None,
+        )
+        return Body(city_data, "application/json")
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return {"error": f"An error occurred while processing the request: {e}"}, 500
+
+
+#4. Widgets of /api/sales/dashboard, by the endpoint that answers them
+DASHBOARD_WIDGETS = ["subcategory-series", "cities", "fetch-event-sales", "fetch-sales-trend"]
+
+
+def dashboard_widgets(args):
+    """The widgets a dashboard request asks for and the query parameters they share, or an error response."""
+    widgets = args.get("widgets")
+    widgets = [widget.strip() for widget in widgets.split(",") if widget.strip()] if widgets else list(DASHBOARD_WIDGETS)
+    unknown = [widget for widget in widgets if widget not in DASHBOARD_WIDGETS]
+    if unknown:
+        return None, ({"error": f"Unknown widgets {unknown}. Choose from {DASHBOARD_WIDGETS}."}, 400)
+
+    # Every widget sees the same filters as a direct call, so they share its result cache entries
+    return widgets, [(name, value) for name, value in args.items(multi=True) if name != "widgets"]
+
+
+def dashboard_body(widgets, results):
+    """One JSON document of the widgets' (status, JSON body) results; the bodies are embedded as they are."""
+    body = ",".join(
+        f'{json.dumps(widget)}:{{"status":{status},"data":{data}}}'
+        for widget, (status, data) in zip(widgets, results)
+    )
+    return Body("{" + body + "}", "application/json")
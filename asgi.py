@@ -0,0 +1,303 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from urllib.parse import urlencode
+
+from dotenv import load_dotenv
+from quart import Quart, Response, g, request, send_file
+from quart.wrappers.response import DataBody
+from quart_cors import cors
+
+import api
+import cache
+import db
+import jobs
+import metrics
+import queries
+import sales_engine
+from excel import XLSX_MIMETYPE
+from exports import ExportError, event_sales_export, sales_trend_export, subcategory_export
+from trends import model_cache_stats
+
+# ASGI mode of the app.py endpoints: `uvicorn asgi:app`, or `gunicorn asgi:app -k uvicorn_worker.UvicornWorker`
+# for several workers (see gunicorn.conf.py). Every request of a worker runs on its one event loop, which also
+# owns the connection pool: queries are awaited directly instead of being handed to a pool thread, and
+# streamed bodies read their cursor on the same loop. Excel exports are fitted and written on a thread so that
+# they do not hold up the loop.
+
+# Bytes per read when a workbook is sent from its temporary file
+FILE_CHUNK_BYTES = 1024 * 1024
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+
+# Load environment variables
+load_dotenv()
+
+app = cors(Quart(__name__))
+# Streamed exports of a long date range take as long as they take, as with Flask
+app.config["RESPONSE_TIMEOUT"] = None
+
+
+@app.before_serving
+async def open_pool():
+    # The sales engine and export job threads hand their queries over to this loop as well
+    await db.init_pool()
+    sales_engine.init_app(app)
+
+
+@app.after_serving
+async def close_pool():
+    await db.close_pool()
+
+
+async def start_timer():
+    g.metrics_started = time.perf_counter()
+    metrics.request_route.set(request.url_rule.rule if request.url_rule is not None else None)
+
+
+async def record_response(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        route = metrics.current_route()
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method, response.status_code)
+        if isinstance(response.response, DataBody):
+            metrics.RESPONSE_BYTES.observe(response.content_length or 0, route)
+    return response
+
+
+if metrics.METRICS_ENABLED:
+    metrics.start_flushing()
+    app.before_request(start_timer)
+    app.after_request(record_response)
+    app.add_url_rule(
+        "/metrics",
+        "metrics",
+        lambda: app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4"),
+    )
+
+
+def cached(endpoint):
+    """cache.cached for the views below."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            if not cache.CACHE_ENABLED:
+                return await view(*args, **kwargs)
+
+            hit, ticket = await cache.lookup(endpoint, request.args)
+            if hit is not None:
+                body, mimetype = hit
+                return app.response_class(body, mimetype=mimetype)
+
+            response = await app.make_response(await view(*args, **kwargs))
+            if response.status_code == 200 and isinstance(response.response, DataBody):
+                cache.store(ticket, await response.get_data(), response.mimetype)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def respond(result):
+    if isinstance(result, api.Body):
+        return app.response_class(result.content, mimetype=result.mimetype)
+    if isinstance(result, api.Stream):
+        return Response(result.achunks(), mimetype=result.mimetype, headers=result.headers)
+    return result
+
+
+#T1. Fetch sales trend and estimate sales trend when applying for discounts
+@app.get("/api/sales/fetch-sales-trend")
+@cached("fetch-sales-trend")
+async def fetch_sales_with_discounts():
+    return respond(await api.sales_trend(request.args))
+
+
+#2. API endpoint to fetch sales
+@app.get("/api/sales/fetch-sales")
+async def fetch_sales():
+    return respond(await api.sales(request.args))
+
+
+#2. API endpoint to export raw sales rows as streamed CSV, Parquet or Arrow IPC
+@app.get("/api/sales/export-sales-data")
+async def export_sales_data():
+    return respond(await api.sales_data_export(request.args))
+
+
+async def file_chunks(output):
+    """Read a file chunk by chunk on a thread, and close it once it is sent."""
+    try:
+        while chunk := await asyncio.to_thread(output.read, FILE_CHUNK_BYTES):
+            yield chunk
+    finally:
+        output.close()
+
+
+#2. Build an export within the request and send it as a download
+async def send_export(build):
+    try:
+        # The queries are awaited on this loop; fitting and writing the workbook run on a thread
+        excel_output, download_name = await build(request.args, run=asyncio.to_thread)
+        size = excel_output.seek(0, os.SEEK_END)
+        excel_output.seek(0)
+        return Response(
+            file_chunks(excel_output),
+            mimetype=XLSX_MIMETYPE,
+            headers={"Content-Disposition": f"attachment; filename={download_name}", "Content-Length": str(size)}
+        )
+    except ExportError as e:
+        return {"error": str(e)}, e.status
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return {"error": f"An error occurred while processing the request: {e}"}, 500
+
+
+#2. API endpoint to export sales data and generate report
+@app.get("/api/sales/export-sales")
+async def export_sales():
+    return await send_export(sales_trend_export)
+
+
+#1. API endpoint to fetch all categories
+@app.get("/api/sales/categories")
+@cached("categories")
+async def fetch_categories():
+    return respond(await api.categories(request.args))
+
+
+#1. API endpoint to fetch sales per subcategory filtering by category
+@app.get("/api/sales/subcategory-series")
+@cached("subcategory-series")
+async def get_sales_per_subcategory():
+    return respond(await api.subcategory_series(request.args))
+
+
+#1. Export bar chart per subcategory filtering by categories
+@app.get("/api/sales/export-subcategory-bar-chart")
+async def export_sales_per_subcategory_with_bar_chart():
+    return await send_export(subcategory_export)
+
+
+#3. API endpoint to fetch sales data for event linking, filter by category
+@app.get("/api/sales/fetch-event-sales")
+@cached("fetch-event-sales")
+async def fetch_event_sales():
+    return respond(await api.event_sales(request.args))
+
+
+#3. API endpoint to export sales per event charts
+@app.get("/api/sales/export-event-sales")
+async def export_event_sales_plot():
+    return await send_export(event_sales_export)
+
+
+# API endpoint to start an export in the background; identical requests share one job
+@app.post("/api/sales/export-jobs/<export>")
+async def start_export_job(export):
+    try:
+        job = await jobs.submit(export, request.args)
+    except KeyError:
+        return {"error": f"Unknown export. Choose from {list(jobs.EXPORTS.keys())}."}, 404
+    except jobs.JobQueueFull as e:
+        return {"error": str(e)}, 503
+    return job.to_dict(), 202, {"Location": f"/api/sales/export-jobs/{job.id}"}
+
+
+# API endpoint to report the status of an export job
+@app.get("/api/sales/export-jobs/<job_id>")
+async def export_job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "Export job not found or expired."}, 404
+    return job.to_dict()
+
+
+# API endpoint to download a finished export
+@app.get("/api/sales/export-jobs/<job_id>/download")
+async def download_export_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "Export job not found or expired."}, 404
+    if job.status == jobs.FAILED:
+        return {"error": job.error}, job.error_status
+    if job.status != jobs.DONE:
+        return {"error": "Export is not ready yet.", **job.to_dict()}, 409
+    try:
+        return await send_file(
+            job.path,
+            mimetype=XLSX_MIMETYPE,
+            as_attachment=True,
+            attachment_filename=job.download_name or f"{job.id}.xlsx"
+        )
+    except FileNotFoundError:
+        return {"error": "Export job not found or expired."}, 404
+
+
+# API endpoint to fetch sales data grouped per city
+@app.get("/api/sales/cities")
+@cached("cities")
+async def fetch_sales_by_city():
+    return respond(await api.city_sales(request.args))
+
+
+# Views of the widgets of /api/sales/dashboard
+DASHBOARD_VIEWS = {
+    "subcategory-series": get_sales_per_subcategory,
+    "cities": fetch_sales_by_city,
+    "fetch-event-sales": fetch_event_sales,
+    "fetch-sales-trend": fetch_sales_with_discounts,
+}
+
+
+#4. Answer one dashboard widget through its endpoint, in a request context of its own
+async def render_widget(name, query_string):
+    path = f"/api/sales/{name}"
+    metrics.request_route.set(path)
+    async with app.test_request_context(f"{path}?{query_string}"):
+        response = await app.make_response(await DASHBOARD_VIEWS[name]())
+        return response.status_code, await response.get_data(as_text=True)
+
+
+#4. API endpoint to load several dashboard widgets with one filter set; their queries run concurrently on the pool
+@app.get("/api/sales/dashboard")
+async def fetch_dashboard():
+    try:
+        widgets, params = api.dashboard_widgets(request.args)
+        if widgets is None:
+            return params
+        query_string = urlencode(params)
+        results = await asyncio.gather(*(render_widget(widget, query_string) for widget in widgets))
+        return respond(api.dashboard_body(widgets, results))
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return {"error": f"An error occurred while processing the request: {e}"}, 500
+
+
+# API endpoint to check the database connection pool
+@app.get("/api/health")
+async def health_check():
+    try:
+        pool = await db.health()
+        listeners = db.listener_health()
+        # A lost LISTEN is being re-established; meanwhile cached results can go stale
+        status = "ok" if all(listener["connected"] for listener in listeners) else "degraded"
+        return {"status": status, "pool": pool, "listeners": listeners}
+    except Exception as e:
+        logging.error(f"Health check failed: {e}")
+        return {"status": "unavailable", "error": str(e)}, 503
+
+
+# API endpoint to report result cache, trend model cache, prepared statement and sales engine usage
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {**cache.stats(), "trend_models": model_cache_stats(), "statements": queries.stats(), "engine": sales_engine.stats()}
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import date
+
+import asyncpg
+
+import queries
+from migrate import DB_URL
+
+# Grouped rows of /api/sales/cities, before the per-city aggregation
+CITY_GROUPS = queries.Statement("city_sales_groups", queries.CITY_SALES_GROUPS)
+
+
+def aggregate_in_python(sales_data):
+    """The per-row loop the endpoint used before the aggregation moved into SQL."""
+    city_data = {}
+    for row in sales_data:
+        city_name = row["city_name"]
+        if city_name not in city_data:
+            city_data[city_name] = {
+                "latitude": row["latitude"],
+                "longitude": row["longitude"],
+                "total_sales": 0,
+                "transaction_count": 0,
+                "average_sale": 0,
+                "min_sale": None,
+                "max_sale": None,
+                "gender_breakdown": {},
+                "age_group_distribution": {}
+            }
+        city = city_data[city_name]
+
+        city["total_sales"] += row["total_sales"]
+        city["transaction_count"] += row["transaction_count"]
+        city["average_sale"] = city["total_sales"] / city["transaction_count"]
+        city["min_sale"] = min(filter(None, [city["min_sale"], row["min_sale"]]))
+        city["max_sale"] = max(filter(None, [city["max_sale"], row["max_sale"]]))
+
+        gender = row["gender"]
+        city["gender_breakdown"][gender] = city["gender_breakdown"].get(gender, 0) + row["group_count"]
+
+        key = f"{row['age_group']} ({row['age_group_description']})"
+        city["age_group_distribution"][key] = city["age_group_distribution"].get(key, 0) + row["group_count"]
+
+    for city in city_data.values():
+        total_count = city["transaction_count"]
+        city["gender_breakdown"] = {k: round((v / total_count) * 100, 2) for k, v in city["gender_breakdown"].items()}
+        city["age_group_distribution"] = {k: round((v / total_count) * 100, 2) for k, v in city["age_group_distribution"].items()}
+
+    return json.dumps(city_data, default=str, sort_keys=True)
+
+
+def normalized(document):
+    """Parse a response body with every number as a float rounded to cents, for comparing the two paths."""
+    def convert(value):
+        if isinstance(value, dict):
+            return {str(k): convert(v) for k, v in value.items()}
+        try:
+            return round(float(value), 2)
+        except (TypeError, ValueError):
+            return value
+
+    return convert(json.loads(document))
+
+
+async def timed(runs, fn):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        body = await fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), body
+
+
+async def benchmark(start_date, end_date, runs, dsn=DB_URL):
+    conn = await asyncpg.connect(dsn=dsn)
+    try:
+        values = {"start_date": start_date, "end_date": end_date}
+
+        async def python_loop():
+            return aggregate_in_python(await conn.fetch(CITY_GROUPS.sql, *CITY_GROUPS.args(values)))
+
+        async def sql_pushdown():
+            return await conn.fetchval(queries.CITY_SUMMARY.sql, *queries.CITY_SUMMARY.args(values))
+
+        loop_ms, loop_body = await timed(runs, python_loop)
+        sql_ms, sql_body = await timed(runs, sql_pushdown)
+    finally:
+        await conn.close()
+
+    print(f"Python loop:  {loop_ms:8.1f} ms")
+    print(f"SQL pushdown: {sql_ms:8.1f} ms ({loop_ms / sql_ms if sql_ms else 0:.1f}x)")
+    print(f"Same cities and totals: {normalized(loop_body) == normalized(sql_body)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time /api/sales/cities aggregation in Python against the SQL pushdown.")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2008, 1, 1), help="First day of the queried range (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, default=date(2024, 12, 31), help="Last day of the queried range (YYYY-MM-DD)")
+    parser.add_argument("--runs", type=int, default=5, help="Executions per path; the median is reported")
+    parser.add_argument("--dsn", default=DB_URL, help="Database URL (defaults to DB_URL)")
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.start, args.end, args.runs, args.dsn))
@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode
+
+import asyncpg
+
+import data
+from benchmark_results import REGRESSION_THRESHOLD, compare_results, print_results, rss_mb, save_results, summarize, tree_rss_mb
+from migrate import DB_URL, migrate
+
+# Seconds before a request against --url is given up on
+REQUEST_TIMEOUT = 300
+
+# Commands that serve the app for --server; both pick up gunicorn.conf.py
+SERVERS = {
+    "flask": ["gunicorn", "app:app"],
+    "asgi": ["gunicorn", "asgi:app", "-k", "uvicorn_worker.UvicornWorker"],
+}
+SERVER_STARTUP_TIMEOUT = 60  # Seconds for a --server to answer /api/health
+
+GENDERS = ["Male", "Female", "Other"]
+AGE_RANGES = [(13, 19), (20, 64), (65, 85), (25, 40)]
+DATE_SPANS = [30, 90, 365, 3 * 365]  # Days
+TREND_TYPES = ["linear", "polynomial", "moving_average", "logarithmic", "exponential", "power-law"]
+FREQUENCIES = ["Daily", "Monthly", "Yearly"]
+
+
+async def seed(scale, seed_value, dsn=DB_URL):
+    """Migrate the database and seed it at scale unless it already holds sales; return the number of sales."""
+    await migrate(dsn=dsn)
+    conn = await asyncpg.connect(dsn=dsn)
+    try:
+        sales = await conn.fetchval("SELECT count(*) FROM sales;")
+    finally:
+        await conn.close()
+    if sales:
+        print(f"Database already holds {sales} sales, seeding skipped.")
+        return sales
+
+    await data.create_and_insert_data(scale, seed_value, dsn=dsn)
+    conn = await asyncpg.connect(dsn=dsn)
+    try:
+        return await conn.fetchval("SELECT count(*) FROM sales;")
+    finally:
+        await conn.close()
+
+
+async def filter_values(dsn=DB_URL):
+    """City names and category ids that the generated filters pick from."""
+    conn = await asyncpg.connect(dsn=dsn)
+    try:
+        cities = [row["city_name"] for row in await conn.fetch("SELECT city_name FROM cities ORDER BY city_id LIMIT 50;")]
+        categories = [row["category_id"] for row in await conn.fetch("SELECT category_id FROM categories ORDER BY category_id;")]
+    finally:
+        await conn.close()
+    return {"cities": cities, "categories": categories}
+
+
+# Filter mix: most requests leave a filter at "All", like the dashboard defaults
+def date_range(rng, spans=DATE_SPANS):
+    span = rng.choice(spans)
+    days = (data.SALES_END_DATE - data.SALES_START_DATE).days - span
+    start = data.SALES_START_DATE + timedelta(days=rng.randrange(max(days, 1)))
+    return {"startDate": start.isoformat(), "endDate": (start + timedelta(days=span)).isoformat()}
+
+
+def gender(rng):
+    return rng.choice(GENDERS) if rng.random() < 0.4 else "All"
+
+
+def age_range(rng, min_name="ageMin", max_name="ageMax"):
+    if rng.random() < 0.7:
+        return {}
+    age_min, age_max = rng.choice(AGE_RANGES)
+    return {min_name: age_min, max_name: age_max}
+
+
+def city(rng, values):
+    return rng.choice(values["cities"]) if values["cities"] and rng.random() < 0.2 else "All"
+
+
+def category(rng, values):
+    return rng.choice(values["categories"]) if values["categories"] and rng.random() < 0.5 else "All"
+
+
+def sales_trend_params(rng, values):
+    return {
+        **date_range(rng),
+        "gender": gender(rng),
+        **age_range(rng),
+        "city": city(rng, values),
+        "trendType": rng.choice(TREND_TYPES),
+        "frequency": rng.choice(FREQUENCIES),
+        "predictionPoints": rng.choice([0, 7, 30]),
+    }
+
+
+def sales_rows_params(rng, values):
+    return {**date_range(rng, [7, 30]), "gender": gender(rng), **age_range(rng, "minAge", "maxAge"), "city": city(rng, values)}
+
+
+def subcategory_params(rng, values):
+    params = {**date_range(rng), "gender": gender(rng), **age_range(rng)}
+    chosen = category(rng, values)
+    return params if chosen == "All" else {**params, "category": chosen}
+
+
+def event_params(rng, values):
+    params = {**date_range(rng), "gender": gender(rng)}
+    chosen = category(rng, values)
+    return params if chosen == "All" else {**params, "category": chosen}
+
+
+def cities_params(rng, values):
+    return {**date_range(rng), "gender": gender(rng), **age_range(rng), "category": category(rng, values)}
+
+
+# Every /api/sales/* endpoint with a generator of its query parameters. The export-jobs endpoints run the
+# same builders as the synchronous exports in the background and are not driven separately.
+ENDPOINTS = {
+    "fetch-sales-trend": sales_trend_params,
+    "fetch-sales": lambda rng, values: {**sales_rows_params(rng, values), "pageSize": 1000},
+    "export-sales-data": lambda rng, values: {**sales_rows_params(rng, values), "format": rng.choice(["csv", "parquet", "arrow"])},
+    "export-sales": lambda rng, values: {
+        **sales_rows_params(rng, values),
+        "trendType": rng.choice(TREND_TYPES),
+        "frequency": rng.choice(FREQUENCIES),
+    },
+    "categories": lambda rng, values: {},
+    "subcategory-series": subcategory_params,
+    "export-subcategory-bar-chart": subcategory_params,
+    "fetch-event-sales": event_params,
+    "export-event-sales": event_params,
+    "cities": cities_params,
+    "dashboard": lambda rng, values: {**subcategory_params(rng, values), "trendType": rng.choice(TREND_TYPES)},
+}
+
+
+class InProcessClient:
+    """Drives the Flask app through its test client, so RSS is measured on this process."""
+
+    def __init__(self):
+        from app import app
+        logging.getLogger().setLevel(logging.WARNING)  # app.py logs every request at DEBUG
+        self.app = app
+
+    def rss(self):
+        return rss_mb()
+
+    def get(self, path, params):
+        response = self.app.test_client().get(path, query_string=params)
+        size = len(response.get_data())  # Drains streamed bodies
+        response.close()
+        return response.status_code, size
+
+
+class HTTPClient:
+    """Drives a running server; RSS (of the server and its workers) is only reported when its pid is given."""
+
+    def __init__(self, base_url, pid=None):
+        self.base_url = base_url.rstrip("/")
+        self.pid = pid
+
+    def rss(self):
+        return tree_rss_mb(self.pid) if self.pid else None
+
+    def get(self, path, params):
+        url = f"{self.base_url}{path}?{urlencode(params)}" if params else f"{self.base_url}{path}"
+        try:
+            with urllib.request.urlopen(url, timeout=REQUEST_TIMEOUT) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+
+def drive(client, endpoint, requests, concurrency, warmup, values, seed_value):
+    """Send requests (plus unmeasured warmup) to one endpoint from concurrency threads."""
+    rng = random.Random(f"{seed_value}:{endpoint}")
+    path = f"/api/sales/{endpoint}"
+    param_sets = [ENDPOINTS[endpoint](rng, values) for _ in range(warmup + requests)]
+
+    def send(params):
+        started = time.perf_counter()
+        status, size = client.get(path, params)
+        return (time.perf_counter() - started) * 1000, status, size
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, param_sets[:warmup]))
+        started = time.perf_counter()
+        samples = list(executor.map(send, param_sets[warmup:]))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, status, _ in samples if status >= 400),
+        **summarize([ms for ms, _, _ in samples], elapsed),
+        "mean_bytes": round(statistics.mean(size for _, _, size in samples)),
+        "rss_mb": client.rss(),
+    }
+
+
+class Server:
+    """Serves the app in one of the SERVERS modes on a free local port, for the duration of a run."""
+
+    def __init__(self, mode, workers, dsn):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        env = {**os.environ, "DB_URL": dsn, "BIND": f"127.0.0.1:{port}", "WEB_CONCURRENCY": str(workers)}
+        self.process = subprocess.Popen(
+            SERVERS[mode],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        deadline = time.monotonic() + SERVER_STARTUP_TIMEOUT
+        while True:
+            try:
+                with urllib.request.urlopen(f"{self.url}/api/health", timeout=REQUEST_TIMEOUT):
+                    return
+            except (urllib.error.URLError, ConnectionError):
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    sys.exit(f"The {mode} server did not become healthy; run `{' '.join(SERVERS[mode])}` to see why.")
+                time.sleep(0.5)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(timeout=SERVER_STARTUP_TIMEOUT)
+
+
+def main(args):
+    sales = None
+    if args.scale is not None:
+        sales = asyncio.run(seed(args.scale, args.seed, args.dsn))
+    values = asyncio.run(filter_values(args.dsn))
+
+    endpoints = args.endpoints.split(",") if args.endpoints else list(ENDPOINTS)
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        sys.exit(f"Unknown endpoints {unknown}. Choose from {list(ENDPOINTS.keys())}.")
+
+    server = Server(args.server, args.workers, args.dsn) if args.server else None
+    if server is not None:
+        client = HTTPClient(server.url, server.process.pid)
+    else:
+        client = HTTPClient(args.url, args.pid) if args.url else InProcessClient()
+
+    results = {}
+    try:
+        for endpoint in endpoints:
+            results[endpoint] = drive(client, endpoint, args.requests, args.concurrency, args.warmup, values, args.seed)
+            print(f"{endpoint}: p95 {results[endpoint]['p95_ms']} ms", flush=True)
+    finally:
+        if server is not None:
+            server.stop()
+    print_results(results)
+
+    settings = {
+        "scale": args.scale,
+        "sales": sales,
+        "seed": args.seed,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "target": args.server or args.url or "in-process",
+        "workers": args.workers if args.server else None,
+        "result_cache": os.getenv("RESULT_CACHE", "on"),
+    }
+    if args.output:
+        save_results(args.output, "endpoints", settings, results)
+    if args.compare and compare_results(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a local database and load-test every /api/sales/* endpoint.")
+    parser.add_argument("--scale", type=float, default=None, help="Migrate and seed an empty database at this data.py scale factor first")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the data set and the request mix")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per endpoint before timing starts")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--endpoints", default=None, help=f"Comma-separated subset of {','.join(ENDPOINTS)}")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default=None, help="Base URL of a running server (defaults to driving the app in-process)")
+    target.add_argument("--server", choices=SERVERS, default=None, help="Start the app under gunicorn in this mode and drive it over HTTP")
+    parser.add_argument("--pid", type=int, default=None, help="Server process id, for RSS with --url")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes for --server")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="Results JSON of an earlier run; exits non-zero on a regression")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Allowed p95/throughput regression as a fraction")
+    parser.add_argument("--dsn", default=DB_URL, help="Database URL (defaults to DB_URL)")
+    main(parser.parse_args())
@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import json
+import re
+import statistics
+from datetime import date
+
+import asyncpg
+
+from migrate import DB_URL, load_migrations
+
+# Index migration compared by the benchmark
+INDEX_MIGRATION = 2
+
+# The sales-table query of each endpoint (the rollup is bypassed), with its date range as $1 and $2
+ENDPOINT_QUERIES = {
+    "fetch-sales-trend": """
+        SELECT DATE_TRUNC('month', sale_date) AS period, discount_name, discount_rate, SUM(total_price) AS total_sales
+        FROM Sales
+        LEFT JOIN Discounts ON Sales.discount_id = Discounts.discount_id
+        LEFT JOIN Clients ON Sales.client_id = Clients.client_id
+        LEFT JOIN Cities ON Sales.city_id = Cities.city_id
+        WHERE sale_date BETWEEN $1 AND $2 AND sales.discount_id IS NOT NULL
+        GROUP BY period, discount_name, discount_rate ORDER BY period, discount_name;
+    """,
+    "fetch-sales (one page)": """
+        SELECT sale_id, title, age_group_name, description, age, gender, sale_date, quantity, total_price AS total_sales, category_name, city_name
+        FROM Sales
+        LEFT JOIN Clients ON Sales.client_id = Clients.client_id
+        LEFT JOIN Age_groups ON Clients.age_group_id = Age_groups.age_group_id
+        LEFT JOIN Books ON Sales.book_id = Books.book_id
+        LEFT JOIN Subcategories ON Books.subcategory_id = Subcategories.subcategory_id
+        LEFT JOIN Categories ON Subcategories.category_id = Categories.category_id
+        LEFT JOIN Cities ON Sales.city_id = Cities.city_id
+        WHERE sale_date BETWEEN $1 AND $2
+        ORDER BY sale_date, sale_id LIMIT 1000;
+    """,
+    "export-sales": """
+        SELECT DATE_TRUNC('month', sale_date) AS period, SUM(total_price) AS total_sales
+        FROM Sales
+        LEFT JOIN Clients ON Sales.client_id = Clients.client_id
+        LEFT JOIN Age_groups ON Clients.age_group_id = Age_groups.age_group_id
+        LEFT JOIN Cities ON Sales.city_id = Cities.city_id
+        WHERE sale_date BETWEEN $1 AND $2
+        GROUP BY period ORDER BY period;
+    """,
+    "subcategory-series": """
+        SELECT sub.subcategory_name, COUNT(s.sale_id) AS total_sales
+        FROM sales s
+        INNER JOIN books b ON s.book_id = b.book_id
+        INNER JOIN subcategories sub ON b.subcategory_id = sub.subcategory_id
+        INNER JOIN categories cat ON sub.category_id = cat.category_id
+        INNER JOIN clients c ON s.client_id = c.client_id
+        WHERE s.sale_date BETWEEN $1 AND $2
+        GROUP BY sub.subcategory_name ORDER BY sub.subcategory_name;
+    """,
+    "fetch-event-sales": """
+        SELECT e.event_name, cat.category_name, SUM(s.quantity) AS total_quantity_sold, SUM(s.total_price) AS total_sales,
+            COUNT(DISTINCT s.book_id) AS unique_books_sold
+        FROM events e
+        LEFT JOIN sales s ON s.event_id = e.event_id
+        INNER JOIN clients cl ON s.client_id = cl.client_id
+        INNER JOIN books b ON b.book_id = s.book_id
+        INNER JOIN subcategories sub ON b.subcategory_id = sub.subcategory_id
+        LEFT JOIN categories cat ON sub.category_id = cat.category_id
+        WHERE e.start_date BETWEEN $1 AND $2
+        GROUP BY e.event_id, e.start_date, e.end_date, cat.category_name
+        ORDER BY e.start_date;
+    """,
+    "cities": """
+        SELECT c.city_name, SUM(s.total_price) AS total_sales, COUNT(s.sale_id) AS transaction_count,
+            COALESCE(gender, 'Unknown') AS gender, COALESCE(ag.age_group_name, 'Unknown') AS age_group
+        FROM sales s
+        LEFT JOIN clients cl ON s.client_id = cl.client_id
+        LEFT JOIN age_groups ag ON cl.age_group_id = ag.age_group_id
+        LEFT JOIN cities c ON s.city_id = c.city_id
+        INNER JOIN books b ON s.book_id = b.book_id
+        INNER JOIN subcategories sub ON b.subcategory_id = sub.subcategory_id
+        INNER JOIN categories cat ON sub.category_id = cat.category_id
+        WHERE s.sale_date BETWEEN $1 AND $2
+        GROUP BY c.city_id, c.city_name, gender, ag.age_group_name
+        ORDER BY c.city_name, gender, age_group;
+    """,
+}
+
+
+def migration_indexes(version=INDEX_MIGRATION):
+    """Names of the indexes created by a migration."""
+    for migration_version, _, path in load_migrations():
+        if migration_version == version:
+            with open(path, encoding="utf-8") as f:
+                return re.findall(r"CREATE INDEX IF NOT EXISTS (\w+)", f.read())
+    raise ValueError(f"No migration {version}")
+
+
+def scans(plan):
+    """The scan nodes of a JSON plan, e.g. 'Index Only Scan (sales_sale_date_covering_idx)'."""
+    found = []
+    if "Scan" in plan["Node Type"] and plan.get("Relation Name") == "sales":
+        index = plan.get("Index Name")
+        found.append(f"{plan['Node Type']} ({index})" if index else plan["Node Type"])
+    for child in plan.get("Plans", []):
+        found.extend(scans(child))
+    return found
+
+
+async def measure(conn, query, params, runs):
+    """Median execution time (ms) over runs and the plan of the last run."""
+    times = []
+    for _ in range(runs):
+        result = json.loads(await conn.fetchval("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, *params))[0]
+        times.append(result["Execution Time"])
+    return statistics.median(times), result["Plan"]
+
+
+async def benchmark(start_date, end_date, runs, show_plans, dsn=DB_URL):
+    indexes = migration_indexes()
+    conn = await asyncpg.connect(dsn=dsn)
+    try:
+        present = {row["indexname"] for row in await conn.fetch("SELECT indexname FROM pg_indexes WHERE indexname = ANY($1::text[]);", indexes)}
+        if not present:
+            print(f"None of the migration {INDEX_MIGRATION} indexes exist; run migrate.py first.")
+            return
+
+        results = {}
+        # Before: the indexes are dropped inside a transaction that is rolled back afterwards.
+        # DROP INDEX locks the tables until then, so run this against a benchmark database.
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            for index in present:
+                await conn.execute(f"DROP INDEX {index};")
+            for name, query in ENDPOINT_QUERIES.items():
+                results[name] = [await measure(conn, query, [start_date, end_date], runs)]
+        finally:
+            await transaction.rollback()
+
+        for name, query in ENDPOINT_QUERIES.items():
+            results[name].append(await measure(conn, query, [start_date, end_date], runs))
+    finally:
+        await conn.close()
+
+    print(f"{'Endpoint':<24}{'Before (ms)':>12}{'After (ms)':>12}{'Speedup':>9}")
+    for name, ((before, before_plan), (after, after_plan)) in results.items():
+        print(f"{name:<24}{before:>12.1f}{after:>12.1f}{before / after if after else 0:>8.1f}x")
+        print(f"    before: {', '.join(scans(before_plan)) or '-'}")
+        print(f"    after:  {', '.join(scans(after_plan)) or '-'}")
+        if show_plans:
+            print(json.dumps({"before": before_plan, "after": after_plan}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare endpoint query plans and latency with and without the sales indexes.")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2020, 1, 1), help="First day of the queried range (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, default=date(2020, 3, 31), help="Last day of the queried range (YYYY-MM-DD)")
+    parser.add_argument("--runs", type=int, default=5, help="Executions per query; the median is reported")
+    parser.add_argument("--plans", action="store_true", help="Print the full before/after plans")
+    parser.add_argument("--dsn", default=DB_URL, help="Database URL (defaults to DB_URL)")
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.start, args.end, args.runs, args.plans, args.dsn))
@@ -0,0 +1,104 @@
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from benchmark_results import REGRESSION_THRESHOLD, compare_results, print_results, rss_mb, save_results, summarize
+from excel import create_excel_report, create_excel_with_bar_chart, create_separate_charts_with_duration
+from trends import calculate_trend
+
+TREND_TYPES = ["linear", "polynomial", "moving_average", "logarithmic", "exponential", "power-law"]
+PREDICTION_POINTS = 30
+
+
+def sales_series(rng, points):
+    """A noisy, growing daily sales series like the ones the trend endpoints fit."""
+    x = np.arange(points)
+    return (1000 + 5 * x + 200 * np.sin(x / 7) + rng.normal(0, 50, points)).clip(min=1).tolist()
+
+
+def timed(fn, inputs):
+    """Call fn once per input; return the latency summary plus the RSS afterwards."""
+    times = []
+    started = time.perf_counter()
+    for item in inputs:
+        call_started = time.perf_counter()
+        fn(item)
+        times.append((time.perf_counter() - call_started) * 1000)
+    return {**summarize(times, time.perf_counter() - started), "rss_mb": rss_mb()}
+
+
+def trend_benchmarks(rng, sizes, runs):
+    # Every call gets a series of its own, so the fitted-model cache never answers it
+    results = {}
+    for trend_type in TREND_TYPES:
+        for points in sizes:
+            series = [sales_series(rng, points) for _ in range(runs)]
+            results[f"calculate_trend[{trend_type},{points}]"] = timed(
+                lambda y: calculate_trend(np.arange(points), y, trend_type, PREDICTION_POINTS, "Daily"), series
+            )
+    return results
+
+
+def excel_benchmarks(rng, sizes, runs):
+    results = {}
+    end_date = date(2024, 12, 31)
+    for points in sizes:
+        sales = sales_series(rng, points)
+        dates = [end_date - timedelta(days=points - day) for day in range(points)]
+        trend_line, future_trend = calculate_trend(np.arange(points), sales, "linear", PREDICTION_POINTS, "Daily")
+
+        def report(_):
+            create_excel_report(dates, sales, trend_line, future_trend, "Daily", PREDICTION_POINTS, end_date).close()
+
+        results[f"create_excel_report[{points}]"] = timed(report, range(runs))
+
+        subcategories = [f"Subcategory {i}" for i in range(points)]
+        results[f"create_excel_with_bar_chart[{points}]"] = timed(
+            lambda _: create_excel_with_bar_chart(subcategories, sales).close(), range(runs)
+        )
+
+        events = [
+            {
+                "event_name": f"Event {i}",
+                "category_name": "Fiction",
+                "friendly_name": f"Fiction at Event {i}",
+                "total_sales": sale,
+                "total_quantity_sold": int(sale // 10),
+                "average_sales_per_day": sale / 7,
+                "average_books_sold_per_day": int(sale // 70),
+                "unique_books_sold": int(sale // 20),
+                "duration": 7,
+            }
+            for i, sale in enumerate(sales)
+        ]
+        results[f"create_separate_charts_with_duration[{points}]"] = timed(
+            lambda _: create_separate_charts_with_duration(iter(events)).close(), range(runs)
+        )
+    return results
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = {**trend_benchmarks(rng, sizes, args.runs), **excel_benchmarks(rng, sizes, args.runs)}
+    print_results(results)
+
+    settings = {"seed": args.seed, "runs": args.runs, "sizes": sizes}
+    if args.output:
+        save_results(args.output, "micro", settings, results)
+    if args.compare and compare_results(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for calculate_trend and the Excel builders.")
+    parser.add_argument("--sizes", default="30,365,3650", help="Comma-separated series lengths / row counts")
+    parser.add_argument("--runs", type=int, default=50, help="Calls per benchmark")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the generated series")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="Results JSON of an earlier run; exits non-zero on a regression")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Allowed p95/throughput regression as a fraction")
+    main(parser.parse_args())
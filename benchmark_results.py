@@ -0,0 +1,94 @@
+import json
+import statistics
+import subprocess
+from datetime import datetime
+
+# Fraction of the p95 latency or throughput a run may lose against the baseline before --compare fails
+REGRESSION_THRESHOLD = 0.10
+
+
+def rss_mb(pid="self"):
+    """Resident set size of a process in MiB, or None when it cannot be read."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def tree_rss_mb(pid):
+    """Resident set size of a process and its children (a server and its workers) in MiB; shared pages count per process."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            pids = [pid] + [int(child) for child in children.read().split()]
+    except OSError:
+        return rss_mb(pid)
+    sizes = [size for size in (rss_mb(child) for child in pids) if size is not None]
+    return round(sum(sizes), 1) if sizes else None
+
+
+def summarize(times, elapsed):
+    """Latency percentiles of times (ms) and the throughput of len(times) calls over elapsed seconds."""
+    quantiles = statistics.quantiles(times, n=100, method="inclusive") if len(times) > 1 else times * 99
+    return {
+        "p50_ms": round(quantiles[49], 3),
+        "p95_ms": round(quantiles[94], 3),
+        "p99_ms": round(quantiles[98], 3),
+        "throughput_rps": round(len(times) / elapsed, 2) if elapsed else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    width = max([len(name) for name in results] + [4])
+    print(f"{'name':<{width}} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'calls/s':>8} {'errors':>7} {'RSS MiB':>8}")
+    for name, result in results.items():
+        rss = "-" if result.get("rss_mb") is None else result["rss_mb"]
+        print(
+            f"{name:<{width}} {result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} "
+            f"{result.get('throughput_rps') or '-':>8} {result.get('errors', 0):>7} {rss:>8}"
+        )
+
+
+def save_results(path, kind, settings, results):
+    """Write one run as JSON, tagged with the commit it measured."""
+    document = {
+        "kind": kind,
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "settings": settings,
+        "results": results,
+    }
+    with open(path, "w") as output:
+        json.dump(document, output, indent=2)
+    print(f"Results written to {path}")
+
+
+def compare_results(results, baseline_path, threshold=REGRESSION_THRESHOLD):
+    """Print the change of every result against a saved run; return the names that regressed."""
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"Against {baseline_path} (commit {baseline.get('commit')}):")
+    regressions = []
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"  {name} new")
+            continue
+        change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        regressed = change > threshold
+        if before.get("throughput_rps") and result.get("throughput_rps"):
+            regressed |= result["throughput_rps"] < before["throughput_rps"] * (1 - threshold)
+        if regressed:
+            regressions.append(name)
+        print(f"  {name} p95 {before['p95_ms']:>9} -> {result['p95_ms']:>9} ms ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return regressions
@@ -0,0 +1,197 @@
+import functools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+
+import db
+
+# Result cache settings
+CACHE_ENABLED = os.getenv("RESULT_CACHE", "on").lower() != "off"
+CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 300))  # Seconds
+CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Postgres channel notified by migration 0005_cache_invalidation whenever sales are written, and by 0006 when
+# client, book or subcategory attributes that the rollup copies change (the payload is then the table name)
+INVALIDATION_CHANNEL = "sales_changed"
+
+
+class CacheBackend:
+    """Storage interface for cached results, so a shared store can replace the in-process one."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, size):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """Thread-safe in-process LRU cache with a TTL (None never expires) and a bound on the total size of the values."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+            self._entries[key] = (expires_at, value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+_backend = LRUCache()
+_generation = 0  # Bumped on every invalidation so results read before it are not stored
+_invalidated_at = 0.0  # Time of the last invalidation, or of the start of listening for them
+_listening = False
+_listen_lock = threading.Lock()
+
+
+def set_backend(backend):
+    """Replace the cache store, e.g. with a backend shared between processes."""
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    return _backend
+
+
+def invalidate(payload=None):
+    """Drop every cached result; called when sales are written."""
+    global _generation, _invalidated_at
+    _generation += 1
+    _invalidated_at = time.time()
+    _backend.clear()
+    logging.debug(f"Result cache invalidated ({payload or 'manual'})")
+
+
+def stats():
+    return _backend.stats()
+
+
+def cache_key(endpoint, args):
+    """Endpoint plus its query parameters, sorted, with blanks and "All" filters dropped."""
+    params = sorted(
+        (name, value.strip())
+        for name, value in args.items(multi=True)
+        if value.strip() and value.strip() != "All"
+    )
+    return endpoint + "?" + "&".join(f"{name}={value}" for name, value in params)
+
+
+async def _ensure_listener():
+    global _listening, _invalidated_at
+    if _listening:
+        return
+    with _listen_lock:
+        if _listening:
+            return
+        _listening = True
+    try:
+        await db.listen(INVALIDATION_CHANNEL, invalidate)
+        # Sales may have changed before this process listened
+        _invalidated_at = time.time()
+    except Exception as e:
+        _listening = False
+        logging.error(f"Could not listen for sales changes: {e}")
+
+
+async def last_invalidation():
+    """When sales last changed as far as this process can tell; results read before then may be stale."""
+    await _ensure_listener()
+    return _invalidated_at
+
+
+async def lookup(endpoint, args):
+    """The cached (body, mimetype) of a request, or None, plus the ticket to store() its response under."""
+    await _ensure_listener()
+    key = cache_key(endpoint, args)
+    return _backend.get(key), (key, _generation)
+
+
+def store(ticket, body, mimetype):
+    """Cache a response body, unless the results were invalidated since its ticket was issued."""
+    key, generation = ticket
+    if generation == _generation:
+        _backend.set(key, (body, mimetype), len(body) + len(key))
+
+
+def cached(endpoint):
+    """Cache successful responses of an async view, keyed on the endpoint and its query parameters."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            if not CACHE_ENABLED:
+                return await view(*args, **kwargs)
+
+            hit, ticket = await lookup(endpoint, request.args)
+            if hit is not None:
+                body, mimetype = hit
+                return current_app.response_class(body, mimetype=mimetype)
+
+            response = current_app.make_response(await view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                store(ticket, response.get_data(), response.mimetype)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,126 @@
+import csv
+import io
+import os
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+# Rows per cursor fetch for columnar exports; each batch becomes one Arrow record batch / Parquet row group
+COLUMNAR_BATCH_ROWS = int(os.getenv("COLUMNAR_BATCH_ROWS", 65536))
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+# Output column, source column of queries.SALES_ROWS, Arrow type and optional conversion
+SALES_COLUMNS = [
+    ("sale_id", "sale_id", pa.int32(), None),
+    ("book_title", "title", pa.string(), None),
+    ("age_group", "age_group_name", pa.string(), None),
+    ("age_group_description", "description", pa.string(), None),
+    ("age", "age", pa.float64(), _float),  # NUMERIC without a fixed scale
+    ("gender", "gender", pa.string(), None),
+    ("sale_date", "sale_date", pa.date32(), None),
+    ("quantity", "quantity", pa.int32(), None),
+    ("total_sales", "total_sales", pa.decimal128(10, 2), None),
+    ("category", "category_name", pa.string(), None),
+    ("city", "city_name", pa.string(), None),
+]
+
+SALES_SCHEMA = pa.schema([(name, arrow_type) for name, _, arrow_type, _ in SALES_COLUMNS])
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that collects what the Arrow writers produce until it is drained into the response."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def record_batch(rows):
+    """Build one Arrow record batch, column by column, from a list of sales rows."""
+    arrays = []
+    for _, source, arrow_type, convert in SALES_COLUMNS:
+        values = [row[source] for row in rows]
+        if convert is not None:
+            values = [convert(value) for value in values]
+        arrays.append(pa.array(values, type=arrow_type))
+    return pa.RecordBatch.from_arrays(arrays, schema=SALES_SCHEMA)
+
+
+class CSVEncoder:
+    """Encodes sales rows as CSV text, the header first."""
+
+    batch_size = COLUMNAR_BATCH_ROWS
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow([name for name, _, _, _ in SALES_COLUMNS])
+
+    def _drain(self):
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text
+
+    def encode(self, rows):
+        self._writer.writerows([row[source] for _, source, _, _ in SALES_COLUMNS] for row in rows)
+        return self._drain()
+
+    def finish(self):
+        return self._drain()
+
+
+class ArrowEncoder:
+    """Encodes sales rows as an Arrow IPC stream or a Parquet file, one record batch / row group per call."""
+
+    batch_size = COLUMNAR_BATCH_ROWS
+
+    def __init__(self, file_format):
+        self._sink = _ChunkSink()
+        if file_format == "parquet":
+            self._writer = pq.ParquetWriter(self._sink, SALES_SCHEMA, compression="snappy")
+        else:
+            self._writer = ipc.new_stream(self._sink, SALES_SCHEMA)
+
+    def encode(self, rows):
+        self._writer.write_batch(record_batch(rows))
+        return self._sink.drain()
+
+    def finish(self):
+        # Closing the writer adds the end-of-stream marker or the Parquet footer
+        self._writer.close()
+        return self._sink.drain()
+
+
+def encoder(file_format):
+    """An encoder of sales rows in file_format, fed one cursor batch at a time."""
+    if file_format == "csv":
+        return CSVEncoder()
+    return ArrowEncoder(file_format)
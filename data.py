@@ -1,7 +1,10 @@
+import argparse
 import asyncpg
 import asyncio
 import random
-from datetime import date, timedelta
+import time
+from datetime import date
+import numpy as np
 from faker import Faker
 
 
@@ -27,6 +30,20 @@ DB_CONFIG = {
     "port": 5432,
 }
 
+# Row counts at scale factor 1; --scale multiplies them
+BASE_CLIENTS = 2000
+BASE_BOOKS = 3000
+BASE_SALES = 20000
+
+# Sales are generated and copied in batches of this many rows
+SALES_BATCH_SIZE = 100_000
+
+# Faker is slow, so names and titles are drawn from pools of this many generated values
+FAKE_POOL_SIZE = 5000
+
+SALES_START_DATE = date(2008, 1, 1)
+SALES_END_DATE = date(2024, 12, 31)
+
 # Sample data for categories and subcategories
 CATEGORIES = ["Fiction", "Technical", "Medical", "Historical", "Philosophy"]
 SUBCATEGORIES = {
@@ -73,149 +90,272 @@ EVENTS = [
     {"name": "Summer Reading Event", "start_date": "2024-06-15", "end_date": "2024-06-20", "event_type": "Festival", "description": "Celebrate summer with discounts on selected books."},
 ]
 
-def random_date_between(start_date, end_date):
-    """Generate a random date between start_date and end_date."""
-    delta = end_date - start_date
-    random_days = random.randint(0, delta.days)
-    return start_date + timedelta(days=random_days)
+def date_ordinals(periods):
+    """Start ordinals and lengths in days (inclusive) of a list of discount/event periods."""
+    starts = np.array([date.fromisoformat(p["start_date"]).toordinal() for p in periods])
+    ends = np.array([date.fromisoformat(p["end_date"]).toordinal() for p in periods])
+    return starts, ends - starts
+
+
+def ordinals_to_dates(ordinals):
+    """Convert an array of day ordinals into a list of datetime.date."""
+    epoch = date(1970, 1, 1).toordinal()
+    return (ordinals - epoch).astype("datetime64[D]").tolist()
+
+
+class ThroughputReport:
+    """Collect rows/second for each table that gets seeded."""
+
+    def __init__(self):
+        self.rows = []
+
+    async def timed(self, table, count, coro):
+        started = time.perf_counter()
+        await coro
+        elapsed = time.perf_counter() - started
+        self.rows.append((table, count, elapsed))
+        print(f"  {table}: {count:,} rows in {elapsed:.2f}s ({count / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    def summary(self):
+        total_rows = sum(count for _, count, _ in self.rows)
+        total_time = sum(elapsed for _, _, elapsed in self.rows)
+        print(f"Inserted {total_rows:,} rows in {total_time:.2f}s ({total_rows / max(total_time, 1e-9):,.0f} rows/s)")
+
+
+async def next_ids(conn, table, id_column, count):
+    """Reserve `count` serial ids for rows copied with explicit ids."""
+    if count == 0:
+        # setval rejects 0, the value it would get on an empty table
+        return []
+    first_id = await conn.fetchval(f"SELECT COALESCE(MAX({id_column}), 0) + 1 FROM {table}")
+    await conn.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', '{id_column}'), $1)", first_id + count - 1
+    )
+    return list(range(first_id, first_id + count))
+
+
+async def drop_foreign_keys(conn, table):
+    """Drop the foreign keys of a table so a bulk load skips the per-row checks."""
+    constraints = await conn.fetch(
+        "SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint "
+        "WHERE conrelid = $1::regclass AND contype = 'f'",
+        table,
+    )
+    for constraint in constraints:
+        await conn.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint["conname"]}"')
+    return constraints
+
+
+async def restore_foreign_keys(conn, table, constraints):
+    """Re-create dropped foreign keys; each one is validated in a single pass over the table."""
+    for constraint in constraints:
+        await conn.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{constraint["conname"]}" {constraint["definition"]}')
+
+
+async def insert_sales(conn, rng, count, books, clients, discount_ids, event_ids, city_ids, batch_size, report):
+    """Generate sales column-wise with NumPy and COPY them in batches."""
+    books = np.array(books)
+    clients = np.array(clients)
+    discount_ids = np.array(discount_ids)
+    event_ids = np.array(event_ids)
+    discount_starts, discount_lengths = date_ordinals(DISCOUNTS)
+    event_starts, event_lengths = date_ordinals(EVENTS)
+    first_day = SALES_START_DATE.toordinal()
+    span = SALES_END_DATE.toordinal() - first_day
+
+    for offset in range(0, count, batch_size):
+        n = min(batch_size, count - offset)
+
+        # Sale date between the full range, moved into a discount and/or event period for half the sales each
+        sale_days = first_day + rng.integers(0, span + 1, n)
+        apply_discount = rng.random(n) < 0.5
+        apply_event = rng.random(n) < 0.5
+
+        discount = rng.integers(0, len(DISCOUNTS), n)
+        discount_days = discount_starts[discount] + rng.integers(0, discount_lengths[discount] + 1)
+        sale_days = np.where(apply_discount, discount_days, sale_days)
+
+        event = rng.integers(0, len(EVENTS), n)
+        event_days = event_starts[event] + rng.integers(0, event_lengths[event] + 1)
+        sale_days = np.where(apply_event, event_days, sale_days)
+
+        quantity = rng.integers(1, 6, n)  # Random quantity sold
+        total_price = np.round(rng.uniform(5.0, 100.0, n) * quantity, 2)  # Random total price
+
+        columns = [
+            books[rng.integers(0, len(books), n)].tolist(),
+            clients[rng.integers(0, len(clients), n)].tolist(),
+            ordinals_to_dates(sale_days),
+            quantity.tolist(),
+            total_price.tolist(),
+            [d if applied else None for d, applied in zip(discount_ids[discount].tolist(), apply_discount.tolist())],
+            [e if applied else None for e, applied in zip(event_ids[event].tolist(), apply_event.tolist())],
+            np.array(city_ids)[rng.integers(0, len(city_ids), n)].tolist() if city_ids else [None] * n,
+        ]
+        await report.timed(
+            "sales",
+            n,
+            conn.copy_records_to_table(
+                "sales",
+                records=zip(*columns),
+                columns=["book_id", "client_id", "sale_date", "quantity", "total_price", "discount_id", "event_id", "city_id"],
+            ),
+        )
+
+
+async def create_and_insert_data(scale=1.0, seed=None, batch_size=SALES_BATCH_SIZE, database=None, dsn=None):
+    """Seed the database; a dsn (database URL) takes precedence over DB_CONFIG and database. Errors are raised."""
+    # Sales need clients and books to refer to, and clients are the smallest table
+    if int(BASE_CLIENTS * scale) < 1:
+        raise ValueError(f"scale must be at least {1 / BASE_CLIENTS} to seed at least one client")
+    random.seed(seed)
+    Faker.seed(seed)
+    rng = np.random.default_rng(seed)
+    report = ThroughputReport()
 
-async def create_and_insert_data():
     # Connect to the database
-    conn = await asyncpg.connect(**DB_CONFIG)
+    if dsn:
+        conn = await asyncpg.connect(dsn=dsn)
+    else:
+        conn = await asyncpg.connect(**{**DB_CONFIG, "database": database or DB_CONFIG["database"]})
+
+    # Seed everything in one transaction so a failed run leaves the database untouched
+    transaction = conn.transaction()
+    await transaction.start()
 
     try:
-        # Insert categories and subcategories
-        category_ids = {}
-        for category, subcategories in SUBCATEGORIES.items():
-            category_id = await conn.fetchval(
-                "INSERT INTO categories (category_name) VALUES ($1) RETURNING category_id", category
-            )
-            category_ids[category] = category_id
+        # The rollup triggers are skipped during the bulk load and the rollup is rebuilt once at the end
+        await conn.execute("SET LOCAL sales_rollup.deferred = 'on'")
+
+        # Insert categories and subcategories, keeping name -> id maps in memory
+        rows = await conn.fetch(
+            "INSERT INTO categories (category_name) SELECT unnest($1::text[]) RETURNING category_id, category_name",
+            list(SUBCATEGORIES.keys()),
+        )
+        category_ids = {row["category_name"]: row["category_id"] for row in rows}
 
-            for subcategory in subcategories:
-                await conn.execute(
-                    "INSERT INTO subcategories (subcategory_name, category_id) VALUES ($1, $2)",
-                    subcategory, category_id,
-                )
+        names = [name for subcategories in SUBCATEGORIES.values() for name in subcategories]
+        parents = [category_ids[category] for category, subcategories in SUBCATEGORIES.items() for _ in subcategories]
+        rows = await conn.fetch(
+            "INSERT INTO subcategories (subcategory_name, category_id) "
+            "SELECT * FROM unnest($1::text[], $2::int[]) RETURNING subcategory_id, subcategory_name, category_id",
+            names, parents,
+        )
+        subcategory_ids = {(row["category_id"], row["subcategory_name"]): row["subcategory_id"] for row in rows}
 
         # Insert age groups
-        age_group_ids = {}
-        for group in AGE_GROUPS:
-            age_group_id = await conn.fetchval(
-                "INSERT INTO age_groups (age_group_name, description) VALUES ($1, $2) RETURNING age_group_id",
-                group["name"], group["description"]
-            )
-            age_group_ids[group["name"]] = age_group_id  # Store the numeric ID, not the name
+        await conn.executemany(
+            "INSERT INTO age_groups (age_group_name, description) VALUES ($1, $2)",
+            [(group["name"], group["description"]) for group in AGE_GROUPS],
+        )
 
-        clients = []
-        for _ in range(2000):
+        # Insert clients
+        client_count = int(BASE_CLIENTS * scale)
+        clients = await next_ids(conn, "clients", "client_id", client_count)
+        names = [fake.name() for _ in range(min(client_count, FAKE_POOL_SIZE))]
+        client_rows = []
+        for client_id in clients:
             age = random.randint(13, 85)  # Assuming the age range is from 13 to 85
-           
-            
-            # Make sure to use the correct age group ID (numeric) from the dictionary
-            age_group_id = get_age_group(age)  # Correct reference
-
             gender = random.choice(["Male", "Female", "Other"])
-            client_name = fake.name()
-    
-            # Insert client into the database
-            client_id = await conn.fetchval(
-                "INSERT INTO clients (client_name, gender, age_group_id, age) VALUES ($1, $2, $3, $4) RETURNING client_id",
-                client_name, gender, age_group_id, age  # Use numeric age_group_id
-            )
-            clients.append(client_id)
+            client_rows.append((client_id, random.choice(names), gender, get_age_group(age), age))
+        await report.timed(
+            "clients",
+            client_count,
+            conn.copy_records_to_table(
+                "clients", records=client_rows, columns=["client_id", "client_name", "gender", "age_group_id", "age"]
+            ),
+        )
 
         # Insert books
-        books = []
-        for _ in range(3000):
-            title = fake.sentence(nb_words=3).rstrip(".")
-            author = fake.name()
-            publication_year = random.randint(1990, 2024)
-            subcategory = random.choice(list(SUBCATEGORIES.keys()))
-            subcategory_id = await conn.fetchval(
-                "SELECT subcategory_id FROM subcategories WHERE subcategory_name = $1 LIMIT 1", 
-                random.choice(SUBCATEGORIES[subcategory])
-            )
-            book_id = await conn.fetchval(
-                "INSERT INTO books (title, author, publication_year, subcategory_id) VALUES ($1, $2, $3, $4) RETURNING book_id",
-                title, author, publication_year, subcategory_id,
-            )
-            books.append(book_id)
-
-        # Insert discounts
-        discount_ids = {}
-        for discount in DISCOUNTS:
-            discount_id = await conn.fetchval(
-                "INSERT INTO discounts (discount_name, discount_rate, start_date, end_date) VALUES ($1, $2, $3, $4) RETURNING discount_id",
-                discount["name"], discount["rate"], date.fromisoformat(discount["start_date"]), date.fromisoformat(discount["end_date"])
-            )
-            discount_ids[discount["name"]] = discount_id
-
-        # Insert events
-        event_ids = {}
-        for event in EVENTS:
-            event_id = await conn.fetchval(
-                "INSERT INTO events (event_name, start_date, end_date, event_type, description) VALUES ($1, $2, $3, $4, $5) RETURNING event_id",
-                event["name"], date.fromisoformat(event["start_date"]), date.fromisoformat(event["end_date"]), event["event_type"], event["description"]
-            )
-            event_ids[event["name"]] = event_id
+        book_count = int(BASE_BOOKS * scale)
+        books = await next_ids(conn, "books", "book_id", book_count)
+        titles = [fake.sentence(nb_words=3).rstrip(".") for _ in range(min(book_count, FAKE_POOL_SIZE))]
+        authors = [fake.name() for _ in range(min(book_count, FAKE_POOL_SIZE))]
+        book_rows = []
+        for book_id in books:
+            category = random.choice(list(SUBCATEGORIES.keys()))
+            subcategory_id = subcategory_ids[(category_ids[category], random.choice(SUBCATEGORIES[category]))]
+            book_rows.append((book_id, random.choice(titles), random.choice(authors), random.randint(1990, 2024), subcategory_id))
+        await report.timed(
+            "books",
+            book_count,
+            conn.copy_records_to_table(
+                "books", records=book_rows, columns=["book_id", "title", "author", "publication_year", "subcategory_id"]
+            ),
+        )
+
+        # Insert discounts and events; ids are kept per period, in the same order as DISCOUNTS / EVENTS
+        rows = await conn.fetch(
+            "INSERT INTO discounts (discount_name, discount_rate, start_date, end_date) "
+            "SELECT name, rate, start_date, end_date "
+            "FROM unnest($1::text[], $2::numeric[], $3::date[], $4::date[]) WITH ORDINALITY "
+            "AS d(name, rate, start_date, end_date, position) ORDER BY position RETURNING discount_id",
+            [d["name"] for d in DISCOUNTS],
+            [d["rate"] for d in DISCOUNTS],
+            [date.fromisoformat(d["start_date"]) for d in DISCOUNTS],
+            [date.fromisoformat(d["end_date"]) for d in DISCOUNTS],
+        )
+        discount_ids = [row["discount_id"] for row in rows]
+
+        rows = await conn.fetch(
+            "INSERT INTO events (event_name, start_date, end_date, event_type, description) "
+            "SELECT name, start_date, end_date, event_type, description "
+            "FROM unnest($1::text[], $2::date[], $3::date[], $4::text[], $5::text[]) WITH ORDINALITY "
+            "AS e(name, start_date, end_date, event_type, description, position) ORDER BY position RETURNING event_id",
+            [e["name"] for e in EVENTS],
+            [date.fromisoformat(e["start_date"]) for e in EVENTS],
+            [date.fromisoformat(e["end_date"]) for e in EVENTS],
+            [e["event_type"] for e in EVENTS],
+            [e["description"] for e in EVENTS],
+        )
+        event_ids = [row["event_id"] for row in rows]
 
         # Insert stock
-        for book_id in books:
-            await conn.execute(
-                "INSERT INTO stock (book_id, current_stock) VALUES ($1, $2) ON CONFLICT (book_id) DO NOTHING",
-                book_id, random.randint(10, 200)  # Random initial stock
-            )
+        await report.timed(
+            "stock",
+            book_count,
+            conn.copy_records_to_table(
+                "stock",
+                records=[(book_id, random.randint(10, 200)) for book_id in books],  # Random initial stock
+                columns=["book_id", "current_stock"],
+            ),
+        )
+
+        # Sales are spread uniformly over the cities table when it has been populated
+        city_ids = [row["city_id"] for row in await conn.fetch("SELECT city_id FROM cities ORDER BY city_id")]
+
+        # Insert sales; the generated ids are valid by construction, so the foreign keys are checked once afterwards
+        sales_count = int(BASE_SALES * scale)
+        if await conn.fetchval("SELECT to_regproc('create_sales_partitions') IS NOT NULL"):
+            await conn.execute("SELECT create_sales_partitions($1, $2)", SALES_START_DATE, SALES_END_DATE)
+        foreign_keys = await drop_foreign_keys(conn, "sales")
+        await insert_sales(conn, rng, sales_count, books, clients, discount_ids, event_ids, city_ids, batch_size, report)
+        await report.timed("sales foreign keys", sales_count, restore_foreign_keys(conn, "sales", foreign_keys))
 
-        # Insert sales
-        start_date = date(2008, 1, 1)
-        end_date = date(2024, 12, 31)
-        for _ in range(20000):
-            book_id = random.choice(books)
-            client_id = random.choice(clients)
-            
-            # Randomly pick a discount or event to apply
-            apply_discount = random.choice([True, False])
-            apply_event = random.choice([True, False])
-
-            sale_date = random_date_between(start_date, end_date)  # Sale date between the full range
-
-            # Determine if discount or event is applicable and adjust sale date accordingly
-            discount_id = None
-            event_id = None
-
-            if apply_discount:
-                # Pick a random discount and set sale date between discount start and end date
-                discount = random.choice(DISCOUNTS)
-                discount_start_date = date.fromisoformat(discount["start_date"])
-                discount_end_date = date.fromisoformat(discount["end_date"])
-                sale_date = random_date_between(discount_start_date, discount_end_date)  # Set sale_date within discount period
-                discount_id = discount_ids[discount["name"]]  # Use the discount ID
-
-            if apply_event:
-                # Pick a random event and set sale date between event start and end date
-                event = random.choice(EVENTS)
-                event_start_date = date.fromisoformat(event["start_date"])
-                event_end_date = date.fromisoformat(event["end_date"])
-                sale_date = random_date_between(event_start_date, event_end_date)  # Set sale_date within event period
-                event_id = event_ids[event["name"]]  # Use the event ID
-
-            quantity = random.randint(1, 5)  # Random quantity sold
-            total_price = round(random.uniform(5.0, 100.0) * quantity, 2)  # Random total price
-
-            await conn.execute(
-                "INSERT INTO sales (book_id, client_id, sale_date, quantity, total_price, discount_id, event_id) VALUES ($1, $2, $3, $4, $5, $6, $7)",
-                book_id, client_id, sale_date, quantity, total_price, discount_id, event_id
+        if await conn.fetchval("SELECT to_regclass('sales_daily_rollup') IS NOT NULL"):
+            await report.timed(
+                "sales_daily_rollup",
+                sales_count,
+                conn.execute("SELECT refresh_sales_rollup($1, $2)", SALES_START_DATE, SALES_END_DATE),
             )
 
+        await transaction.commit()
+        report.summary()
         print("Data insertion complete.")
     except Exception as e:
-        import traceback
-        print(f"An error occurred: {e}")
-        traceback.print_exc()  # This will print the full stack trace
+        await transaction.rollback()
+        print(f"An error occurred, nothing was inserted: {e}")
+        raise
     finally:
         await conn.close()
 
 # Run the script with asyncio.run() for Python 3.10+
 if __name__ == "__main__":
-    asyncio.run(create_and_insert_data())
+    parser = argparse.ArgumentParser(description="Seed the BookSales database with random data.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for the number of clients, books and sales")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for a reproducible data set")
+    parser.add_argument("--batch-size", type=int, default=SALES_BATCH_SIZE, help="Sales rows per COPY batch")
+    parser.add_argument("--database", default=None, help="Database name (defaults to DB_CONFIG)")
+    parser.add_argument("--dsn", default=None, help="Database URL, instead of DB_CONFIG and --database")
+    args = parser.parse_args()
+    asyncio.run(create_and_insert_data(args.scale, args.seed, args.batch_size, args.database, args.dsn))
@@ -0,0 +1,260 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+
+import asyncpg
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Database connection URL and pool tuning
+DB_URL = os.getenv("DB_URL")
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 300))  # Seconds before an idle connection is closed
+POOL_COMMAND_TIMEOUT = float(os.getenv("DB_POOL_COMMAND_TIMEOUT", 60))
+CURSOR_BATCH_SIZE = int(os.getenv("DB_CURSOR_BATCH_SIZE", 1000))  # Rows per server-side cursor fetch
+# asyncpg's per-connection cache of prepared statements, which the canonical statements of queries.py rely on.
+# It has to hold all of them plus the ad-hoc queries, or they evict each other; 0 for the lifetime keeps a
+# statement prepared for as long as its connection lives.
+STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+STATEMENT_CACHE_LIFETIME = float(os.getenv("DB_STATEMENT_CACHE_LIFETIME", 0))  # Seconds
+LISTEN_RETRY_SECONDS = float(os.getenv("DB_LISTEN_RETRY", 5))  # Between attempts to re-establish a lost LISTEN
+
+# Payload listen() callbacks get once a lost LISTEN connection is back: notifications sent meanwhile are gone
+LISTEN_RESUBSCRIBED = "resubscribed"
+
+# Flask runs every async view in a fresh event loop, and an asyncpg pool is bound
+# to the loop that created it. The pool therefore lives on one long-lived loop
+# (a daemon thread by default) and request coroutines hand their work over to it.
+_loop = None
+_thread = None
+_pool = None
+_listeners = []
+_lock = threading.Lock()
+
+
+async def _create_pool():
+    return await asyncpg.create_pool(
+        dsn=DB_URL,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=POOL_MAX_IDLE,
+        command_timeout=POOL_COMMAND_TIMEOUT,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
+        max_cached_statement_lifetime=STATEMENT_CACHE_LIFETIME,
+    )
+
+
+def _start_pool_thread():
+    """Start the background loop that owns the pool and create the pool on it."""
+    global _loop, _thread, _pool
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="db-pool-loop", daemon=True)
+    thread.start()
+    try:
+        pool = asyncio.run_coroutine_threadsafe(_create_pool(), loop).result()
+    except Exception:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        raise
+    _loop, _thread, _pool = loop, thread, pool
+    logging.debug(f"Connection pool created (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE})")
+
+
+def _get_loop():
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _start_pool_thread()
+    return _loop
+
+
+async def init_pool():
+    """Create the pool on the running loop (for servers with one long-lived loop, see asgi.py)."""
+    global _loop, _pool
+    if _pool is None:
+        _pool = await _create_pool()
+        _loop = asyncio.get_running_loop()
+    return _pool
+
+
+async def _on_pool_loop(coro_fn, *args):
+    """Await coro_fn(*args) on the loop that owns the pool."""
+    loop = _get_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro_fn(*args)
+    future = asyncio.run_coroutine_threadsafe(coro_fn(*args), loop)
+    return await asyncio.wrap_future(future)
+
+
+async def _with_connection(fn, *args):
+    async with _pool.acquire() as connection:
+        return await fn(connection, *args)
+
+
+async def run(fn, *args):
+    """Run `await fn(connection, *args)` on a pooled connection."""
+    return await _on_pool_loop(_with_connection, fn, *args)
+
+
+async def fetch(query, *params):
+    return await _on_pool_loop(lambda: _pool.fetch(query, *params))
+
+
+async def fetchrow(query, *params):
+    return await _on_pool_loop(lambda: _pool.fetchrow(query, *params))
+
+
+async def fetchval(query, *params):
+    return await _on_pool_loop(lambda: _pool.fetchval(query, *params))
+
+
+async def execute(query, *params):
+    return await _on_pool_loop(lambda: _pool.execute(query, *params))
+
+
+class _Subscription:
+    """A LISTEN on a dedicated connection (never handed back to the pool), re-established whenever it is lost."""
+
+    def __init__(self, channel, callback):
+        self.channel = channel
+        self.callback = callback
+        self.connection = None
+        self.reconnects = 0
+        self.error = None
+        self.closed = False
+
+    async def connect(self):
+        connection = await asyncpg.connect(dsn=DB_URL)
+        await connection.add_listener(self.channel, lambda conn, pid, ch, payload: self.callback(payload))
+        connection.add_termination_listener(self._lost)
+        self.connection, self.error = connection, None
+
+    def _lost(self, connection):
+        # Called on the pool loop when Postgres restarts, kills the session or the network drops it
+        if self.closed:
+            return
+        self.connection = None
+        logging.warning(f"Lost the LISTEN {self.channel} connection, reconnecting")
+        asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self):
+        while not self.closed:
+            try:
+                await self.connect()
+            except Exception as e:
+                self.error = str(e)
+                logging.error(f"Could not re-establish LISTEN {self.channel}: {e}")
+                await asyncio.sleep(LISTEN_RETRY_SECONDS)
+                continue
+            self.reconnects += 1
+            logging.info(f"LISTEN {self.channel} re-established")
+            self.callback(LISTEN_RESUBSCRIBED)
+            return
+
+    async def close(self):
+        self.closed = True
+        if self.connection is not None:
+            await self.connection.close()
+
+    def state(self):
+        return {
+            "channel": self.channel,
+            "connected": self.connection is not None and not self.connection.is_closed(),
+            "reconnects": self.reconnects,
+            "error": self.error,
+        }
+
+
+async def listen(channel, callback):
+    """Call callback(payload) on the pool loop for every NOTIFY on channel.
+
+    The LISTEN is re-established if its connection is lost; callback then gets LISTEN_RESUBSCRIBED, since
+    whatever was notified in between is lost.
+    """
+    async def subscribe():
+        subscription = _Subscription(channel, callback)
+        await subscription.connect()
+        _listeners.append(subscription)
+
+    await _on_pool_loop(subscribe)
+
+
+def listener_health():
+    """State of every LISTEN connection of this process, for /api/health."""
+    return [subscription.state() for subscription in _listeners]
+
+
+async def cursor_batches(query, *params, batch_size=CURSOR_BATCH_SIZE):
+    """Yield lists of rows read through a server-side cursor (run on the pool loop)."""
+    async with _pool.acquire() as connection:
+        async with connection.transaction():
+            cursor = await connection.cursor(query, *params)
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+
+def iterate(query, *params, batch_size=CURSOR_BATCH_SIZE):
+    """Blocking generator over cursor batches, for streamed response bodies."""
+    loop = _get_loop()
+    batches = cursor_batches(query, *params, batch_size=batch_size)
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(batches.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        # Release the connection even when the client disconnects mid-stream
+        asyncio.run_coroutine_threadsafe(batches.aclose(), loop).result()
+
+
+async def health():
+    """Check that the pool can reach the database and report its usage."""
+    async def check():
+        await _pool.fetchval("SELECT 1;")
+        return {
+            "size": _pool.get_size(),
+            "idle": _pool.get_idle_size(),
+            "min_size": _pool.get_min_size(),
+            "max_size": _pool.get_max_size(),
+        }
+
+    return await _on_pool_loop(check)
+
+
+async def close_pool():
+    global _pool
+    while _listeners:
+        await _listeners.pop().close()
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+def close():
+    """Close the pool and stop the background loop, if one was started."""
+    global _loop, _thread, _pool
+    if _thread is None:
+        return
+    loop, thread = _loop, _thread
+    try:
+        asyncio.run_coroutine_threadsafe(close_pool(), loop).result(timeout=POOL_COMMAND_TIMEOUT)
+    except Exception as e:
+        logging.error(f"Error closing connection pool: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    _loop, _thread, _pool = None, None, None
+    logging.debug("Connection pool closed")
+
+
+atexit.register(close)
@@ -0,0 +1,230 @@
+import logging
+import os
+import tempfile
+from datetime import timedelta
+
+from openpyxl import Workbook
+from openpyxl.chart import BarChart, LineChart, Reference
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Exports are written to temporary files here (the system temp directory by default)
+EXPORT_TMP_DIR = os.getenv("EXPORT_TMP_DIR") or None
+
+
+class StreamingSheet:
+    """A single-sheet write-only workbook: rows go straight to disk instead of being kept as cells.
+
+    Write-only sheets cannot be read back, so the number of rows written is
+    tracked here for the chart references.
+    """
+
+    def __init__(self, title, headers):
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title)
+        self.sheet.append(headers)
+        self.rows = 1  # Including the header row
+
+    def append(self, values):
+        self.sheet.append(values)
+        self.rows += 1
+
+    def add_chart(self, chart, anchor):
+        self.sheet.add_chart(chart, anchor)
+
+    def save(self):
+        """Save to an anonymous temporary file, rewound and ready to stream; it is deleted once closed."""
+        output = tempfile.TemporaryFile(suffix=".xlsx", dir=EXPORT_TMP_DIR)
+        try:
+            self.workbook.save(output)
+        except Exception:
+            output.close()
+            raise
+        output.seek(0)
+        return output
+
+
+#2. export highs and lows of sales + trend
+def create_excel_report(dates, sales, trend_line, future_trend, frequency, prediction_points, end_date):
+    """Create an Excel workbook with an enhanced sales trend chart."""
+    report = StreamingSheet("Sales Data", ["Date", "Total Sales", "Trend Line", "Estimated Future Trend"])
+
+    # Add actual data rows
+    observed = 0
+    for date, sale, trend in zip(dates, sales, trend_line):
+        report.append([date, sale, trend, None])
+        observed += 1
+
+    # Add future prediction rows
+    for i in range(1, prediction_points + 1):
+        future_date = (
+            end_date + timedelta(days=i) if frequency == "Daily" else
+            end_date + timedelta(days=30 * i) if frequency == "Monthly" else
+            end_date + timedelta(days=365 * i)
+        )
+        report.append([future_date, None, None, future_trend[observed + i - 1]])
+
+    # Create and add a line chart
+    chart = LineChart()
+    chart.title = "Sales trend"
+    chart.y_axis.title = "Total sales"
+    chart.x_axis.title = "Date"
+    chart.style = 10
+    chart.x_axis.number_format = 'yyyy-mm-dd'
+
+    # Define data and labels for the chart
+    data = Reference(report.sheet, min_col=2, min_row=1, max_row=report.rows, max_col=4)
+    labels = Reference(report.sheet, min_col=1, min_row=2, max_row=report.rows)
+
+    # Add data to the chart and set categories
+    chart.add_data(data, titles_from_data=True)
+    chart.set_categories(labels)
+
+    # Increase chart size
+    chart.width = 25
+    chart.height = 12
+
+    # Add the chart to the sheet
+    report.add_chart(chart, "G3")
+
+    return report.save()
+
+
+#1. Create bar chart in excel
+def create_excel_with_bar_chart(subcategories, sales):
+    try:
+        report = StreamingSheet("Sales Data", ["Subcategory", "Total Sales"])
+
+        # Add actual data rows (Sales)
+        for subcategory, sale in zip(subcategories, sales):
+            report.append([subcategory, sale])
+
+        # Create a Bar chart for the total sales
+        chart = BarChart()
+        chart.title = "Sales"
+        chart.style = 10
+        chart.y_axis.title = "Total Sales"
+        chart.x_axis.title = "Subcategory"
+
+        # Define the data for the chart (exclude header row for data)
+        data = Reference(report.sheet, min_col=2, min_row=1, max_row=report.rows)
+
+        # Define the categories for the chart (Subcategories)
+        categories = Reference(report.sheet, min_col=1, min_row=2, max_row=report.rows)
+
+        # Add the data and categories to the chart
+        chart.add_data(data, titles_from_data=True)
+        chart.set_categories(categories)
+
+        # Increase chart size
+        chart.width = 25
+        chart.height = 12
+
+        # Position the chart on the sheet
+        report.add_chart(chart, "G5")
+
+        return report.save()
+    except Exception as e:
+        logging.error(f"Error creating Excel file with chart: {e}")
+        raise e  # Raise the error to be caught in the API controller
+
+
+#3. Create bar chart + line chart for sales per event analysis
+def create_separate_charts_with_duration(data):
+    report = StreamingSheet("Event Sales", [
+        "Event name", "Category name", "Friendly name", "Total sales", "Total quantity sold",
+        "Average sales per day", "Average books sold per day", "Unique books sold", "Duration (days)"
+    ])
+
+    # Add data to the sheet, including Duration
+    for entry in data:
+        report.append([
+            entry["event_name"],
+            entry["category_name"],
+            entry["friendly_name"],
+            entry["total_sales"],
+            entry["total_quantity_sold"],
+            entry["average_sales_per_day"],
+            entry["average_books_sold_per_day"],
+            entry["unique_books_sold"],
+            entry["duration"]
+        ])
+    sheet = report.sheet
+    last_row = report.rows
+
+    # Chart 1: Total Sales and Average Sales Per Day
+    # Create a Bar Chart (for Total Sales)
+    bar_chart1 = BarChart()
+    bar_chart1.type = "col"  # Clustered column chart
+    bar_chart1.title = "Total sales and average sales per day"
+    bar_chart1.x_axis.title = "Category sales at events"
+    bar_chart1.y_axis.title = "Values"
+    bar_chart1.width = 30
+    bar_chart1.height = 15
+    bar_chart1.gapWidth = 500
+    bar_chart1.style = 10
+    bar_chart1.x_axis.majorGridlines = None  # Remove gridlines
+
+    # Define data and categories for the Bar Chart
+    bar_data_ref1 = Reference(sheet, min_col=4, max_col=4, min_row=1, max_row=last_row)
+    categories_ref1 = Reference(sheet, min_col=3, min_row=2, max_row=last_row)
+
+    bar_chart1.add_data(bar_data_ref1, titles_from_data=True)
+    bar_chart1.set_categories(categories_ref1)
+
+    # Create a Line Chart (for Average Sales Per Day)
+    line_chart1 = LineChart()
+    line_data_ref1 = Reference(sheet, min_col=6, max_col=6, min_row=1, max_row=last_row)
+    line_chart1.add_data(line_data_ref1, titles_from_data=True)
+    line_chart1.set_categories(categories_ref1)
+    line_chart1.y_axis.axId = 200  # Assign a new Y-axis for the line chart
+    line_chart1.x_axis = bar_chart1.x_axis  # Share the same X-axis with the bar chart
+    line_chart1.title = None  # No separate title for the line chart
+    line_chart1.width = 30
+    line_chart1.height = 15
+    line_chart1.style = 10
+    # Combine the charts
+    bar_chart1.y_axis.crosses = "autoZero"  # Keep bar chart Y-axis on the left
+    bar_chart1 += line_chart1  # Add the line chart to the bar chart
+
+    # Add the first chart to the worksheet
+    report.add_chart(bar_chart1, "K3")
+
+    # Chart 2: Total Quantity Sold and Average Books Sold Per Day
+    # Create a Bar Chart (for Total Quantity Sold)
+    bar_chart2 = BarChart()
+    bar_chart2.type = "col"  # Clustered column chart
+    bar_chart2.title = "Total quantity sold and average books sold per day"
+    bar_chart2.x_axis.title = "Category sales at events"
+    bar_chart2.y_axis.title = "Values"
+    bar_chart2.width = 30
+    bar_chart2.height = 15
+    bar_chart2.gapWidth = 500
+    bar_chart2.style = 10
+
+    # Define data and categories for the Bar Chart
+    bar_data_ref2 = Reference(sheet, min_col=5, max_col=5, min_row=1, max_row=last_row)
+    categories_ref2 = Reference(sheet, min_col=3, min_row=2, max_row=last_row)
+
+    bar_chart2.add_data(bar_data_ref2, titles_from_data=True)
+    bar_chart2.set_categories(categories_ref2)
+
+    # Create a Line Chart (for Average Books Sold Per Day)
+    line_chart2 = LineChart()
+    line_data_ref2 = Reference(sheet, min_col=7, max_col=7, min_row=1, max_row=last_row)
+    line_chart2.add_data(line_data_ref2, titles_from_data=True)
+    line_chart2.set_categories(categories_ref2)
+    line_chart2.y_axis.axId = 300  # Assign a new Y-axis for the line chart
+    line_chart2.x_axis = bar_chart2.x_axis  # Share the same X-axis with the bar chart
+    line_chart2.title = None  # No separate title for the line chart
+    line_chart2.width = 30
+    line_chart2.height = 15
+    line_chart2.style = 10
+    # Combine the charts
+    bar_chart2.y_axis.crosses = "autoZero"  # Keep bar chart Y-axis on the left
+    bar_chart2 += line_chart2  # Add the line chart to the bar chart
+
+    # Add the second chart to the worksheet
+    report.add_chart(bar_chart2, "K45")
+
+    return report.save()
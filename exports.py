@@ -0,0 +1,212 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+
+import metrics
+import queries
+import rollup
+import sales_engine
+from excel import create_excel_report, create_excel_with_bar_chart, create_separate_charts_with_duration
+from trends import calculate_trend
+
+
+class ExportError(Exception):
+    """A request that cannot be exported, with the HTTP status to answer it with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _report(progress, stage):
+    if progress is not None:
+        progress(stage)
+
+
+async def _in_place(function, *args):
+    return function(*args)
+
+
+#2. Build the sales trend workbook for /api/sales/export-sales
+async def sales_trend_export(args, progress=None, run=_in_place):
+    """Return (excel_output, download_name) for the export-sales query parameters.
+
+    run(function, *args) is awaited for the CPU-bound steps (fitting and writing the workbook); the ASGI app
+    passes asyncio.to_thread so that they do not hold up its event loop while the queries run on it.
+    """
+    # Validate and parse query parameters
+    start_date = args.get("startDate")
+    end_date = args.get("endDate")
+    gender = args.get("gender", "All")
+    min_age = args.get("minAge")
+    max_age = args.get("maxAge")
+    city = args.get("city", "All")
+    trend_type = args.get("trendType", "linear")
+    frequency = args.get("frequency", "Daily").capitalize()  # Normalize capitalization
+
+    # Ensure required parameters are present
+    if not start_date or not end_date:
+        raise ExportError("startDate and endDate are required.")
+
+    try:
+        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise ExportError("Invalid date format. Use YYYY-MM-DD.")
+    if start_date > end_date:
+        raise ExportError("startDate must be before endDate.")
+
+    min_age = int(min_age) if min_age else None
+    max_age = int(max_age) if max_age else None
+
+    # Validate frequency
+    valid_frequencies = {"Daily": "day", "Monthly": "month", "Yearly": "year"}
+    if frequency not in valid_frequencies:
+        raise ExportError(f"Invalid frequency. Choose from {list(valid_frequencies.keys())}.")
+
+    # Execute query, from memory or the daily rollup when the filters allow it
+    statement = queries.ROLLUP_PERIOD_SALES if await rollup.can_answer(min_age, max_age) else queries.PERIOD_SALES
+    _report(progress, "querying")
+    result = await sales_engine.fetch(
+        statement,
+        unit=valid_frequencies[frequency],
+        start_date=start_date,
+        end_date=end_date,
+        gender=queries.filter_value(gender),
+        min_age=min_age,
+        max_age=max_age,
+        city=queries.filter_value(city),
+    )
+
+    if not result:
+        raise ExportError("No sales data found for the specified range.", 404)
+
+    # Generate trend line and future predictions
+    _report(progress, "fitting")
+    periods = [row["period"].strftime("%Y-%m-%d") for row in result]
+    sales = [float(row["total_sales"]) for row in result]
+    with metrics.stage("fitting"):
+        trend_line, future_trend = await run(calculate_trend, np.arange(len(sales)), sales, trend_type, len(sales), frequency)
+
+    # Create Excel file with trend chart
+    _report(progress, "writing")
+    with metrics.stage("excel"):
+        excel_output = await run(create_excel_report, periods, sales, trend_line, future_trend, frequency, len(sales), end_date)
+    return excel_output, f"sales_trend_{frequency}.xlsx"
+
+
+#1. Build the subcategory bar chart workbook for /api/sales/export-subcategory-bar-chart
+async def subcategory_export(args, progress=None, run=_in_place):
+    """Return (excel_output, download_name) for the export-subcategory-bar-chart query parameters; see sales_trend_export."""
+    # Get query parameters
+    gender = args.get("gender", None)
+    age_min = args.get("ageMin", None, type=int)
+    age_max = args.get("ageMax", None, type=int)
+    start_date = args.get("startDate", None)
+    end_date = args.get("endDate", None)
+    category = args.get("category", None, type=int)
+
+    # Validate and parse date inputs
+    if not start_date or not end_date:
+        raise ExportError("startDate and endDate are required.")
+
+    try:
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise ExportError("Invalid date format. Use YYYY-MM-DD.")
+
+    # Execute query, from the daily rollup when the filters allow it
+    statement = queries.ROLLUP_SUBCATEGORY_SALES if await rollup.can_answer(age_min, age_max) else queries.SUBCATEGORY_SALES
+    _report(progress, "querying")
+    rows = await sales_engine.fetch(
+        statement,
+        start_date=start_date_obj,
+        end_date=end_date_obj,
+        gender=queries.filter_value(gender),
+        min_age=age_min,
+        max_age=age_max,
+        category=queries.filter_value(category),
+    )
+    logging.debug(f"Executing query: {statement.name}")
+
+    # Prepare data for the Excel file
+    subcategories = [row["subcategory_name"] for row in rows]
+    total_sales = [row["total_sales"] for row in rows]
+
+    if not subcategories or not total_sales:
+        logging.error("Missing data for subcategories or total_sales.")
+        raise ExportError("Missing data for subcategories or sales.")
+
+    # Call the function to generate the Excel file with a bar chart
+    _report(progress, "writing")
+    with metrics.stage("excel"):
+        excel_output = await run(create_excel_with_bar_chart, subcategories, total_sales)
+    return excel_output, "sales_per_subcategory.xlsx"
+
+
+#3. Build the event sales workbook for /api/sales/export-event-sales
+async def event_sales_export(args, progress=None, run=_in_place):
+    """Return (excel_output, download_name) for the export-event-sales query parameters; see sales_trend_export."""
+    # Validate and parse query parameters
+    start_date = args.get("startDate")
+    end_date = args.get("endDate")
+    category = args.get("category", None, type=int)
+    gender = args.get("gender", "All")
+
+    # Ensure required parameters are present
+    if not start_date or not end_date:
+        raise ExportError("startDate and endDate are required.")
+
+    try:
+        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise ExportError("Invalid date format. Use YYYY-MM-DD.")
+    if start_date > end_date:
+        raise ExportError("startDate must be before endDate.")
+
+    # Execute query to fetch event data and sales
+    _report(progress, "querying")
+    result = await sales_engine.fetch(
+        queries.EVENT_SALES,
+        start_date=start_date,
+        end_date=end_date,
+        category=queries.filter_value(category),
+        gender=queries.filter_value(gender),
+    )
+
+    if not result:
+        raise ExportError("No data found for the specified range.", 404)
+
+    # Rows for the workbook, converted as they are written
+    event_sales_data = (
+        {
+            "event_name": row["event_name"],
+            "category_name": row["category_name"],
+            "friendly_name": row["category_name"] + " at " + row["event_name"],
+            "start_date": row["start_date"],
+            "end_date": row["end_date"],
+            "duration": int(row["duration"]),
+            "average_sales_per_day": float(row["average_sales_per_day"]),
+            "average_books_sold_per_day": int(row["average_books_sold_per_day"]),
+            "total_sales": float(row["total_sales"]),
+            "total_quantity_sold": int(row["total_quantity_sold"]),
+            "unique_books_sold": int(row["unique_books_sold"])
+        }
+        for row in result
+    )
+
+    _report(progress, "writing")
+    with metrics.stage("excel"):
+        excel_output = await run(create_separate_charts_with_duration, event_sales_data)
+    return excel_output, "event_sales_data.xlsx"
+
+
+# Export builders by the name used in /api/sales/export-jobs/<export>
+EXPORTS = {
+    "sales": sales_trend_export,
+    "subcategory-bar-chart": subcategory_export,
+    "event-sales": event_sales_export,
+}
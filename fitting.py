@@ -0,0 +1,125 @@
+import warnings
+
+import numpy as np
+from scipy.optimize import OptimizeWarning, curve_fit
+
+# How a series was fitted, reported back to the caller
+CLOSED_FORM = "closed-form"  # Exact linear least squares, no iteration
+LINEARIZED = "linearized"    # Linearized estimate, used when the iterative refinement failed
+ITERATIVE = "iterative"      # scipy curve_fit (Levenberg-Marquardt)
+
+#2. Exponential function for curve fitting
+def exponential_func(x, a, b, c):
+    """Exponential function: a * exp(b * x) + c."""
+    return a * np.exp(b * x) + c
+
+
+def series_mask(lengths, width):
+    return np.arange(width)[None, :] < np.asarray(lengths)[:, None]
+
+
+def lstsq_batch(design, y, mask):
+    """Least-squares coefficients for every row of y against its own design matrix.
+
+    design is (batch, width, k); cells outside mask are ignored. The normal
+    equations of the whole batch are solved at once; pinv gives the
+    minimum-norm solution for rows too short to pin down every coefficient.
+    """
+    design = design * mask[:, :, None]
+    gram = np.einsum("blk,blj->bkj", design, design)
+    moments = np.einsum("blk,bl->bk", design, np.where(mask, y, 0.0))
+    return np.einsum("bkj,bj->bk", np.linalg.pinv(gram), moments)
+
+
+def fit_logarithmic(y, lengths):
+    """a * log(x + 1) + b is linear in (a, b): solved in closed form for the whole batch."""
+    batch, width = y.shape
+    x = np.arange(width, dtype=float)
+    design = np.broadcast_to(np.stack([np.log(x + 1), np.ones(width)], axis=1), (batch, width, 2))
+    params = lstsq_batch(design, y, series_mask(lengths, width))
+    return params, [CLOSED_FORM] * batch
+
+
+def _power_law_iterative(y_data):
+    x_data = np.arange(len(y_data))
+    params, _ = curve_fit(lambda x, a, b: a * x**b, x_data + 1, y_data, p0=(1, 1))
+    return params
+
+
+def fit_power_law(y, lengths):
+    """a * (x + 1) ** b is linear in log-log space, so series with all-positive values are fitted in closed form.
+
+    Series with zero or negative values have no logarithm and fall back to curve_fit.
+    """
+    batch, width = y.shape
+    mask = series_mask(lengths, width)
+    positive = np.all((y > 0) | ~mask, axis=1)
+
+    x = np.arange(width, dtype=float)
+    design = np.broadcast_to(np.stack([np.log(x + 1), np.ones(width)], axis=1), (batch, width, 2))
+    log_y = np.log(np.where(mask & (y > 0), y, 1.0))
+    slope_intercept = lstsq_batch(design, log_y, mask & positive[:, None])
+    params = np.column_stack([np.exp(slope_intercept[:, 1]), slope_intercept[:, 0]])
+    methods = [CLOSED_FORM if ok else ITERATIVE for ok in positive]
+
+    fallback = np.flatnonzero(~positive)
+    if len(fallback):
+        params[fallback] = [_power_law_iterative(y[i, :lengths[i]]) for i in fallback]
+    return params, methods
+
+
+# Candidate growth rates over the whole series for the exponential start (rate b * (n - 1))
+EXPONENTIAL_RATES = np.linspace(-10, 10, 81)
+
+
+def exponential_start(y_data):
+    """Linearized estimate of (a, b, c) for a * exp(b * x) + c on x = 0..n-1.
+
+    For a fixed rate b the model is linear in a and c, so (a, c) are solved in
+    closed form for every candidate rate at once and the rate with the lowest
+    squared error is kept. Returns None when no candidate can be solved.
+    """
+    n = len(y_data)
+    if n < 3:
+        return None
+    span = n - 1
+    t = np.arange(n) / span
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        basis = np.exp(EXPONENTIAL_RATES[:, None] * t[None, :])
+        s11 = (basis**2).sum(axis=1)
+        s12 = basis.sum(axis=1)
+        r1 = basis @ y_data
+        r2 = y_data.sum()
+        det = s11 * n - s12**2
+        a = (r1 * n - s12 * r2) / det
+        c = (s11 * r2 - s12 * r1) / det
+        sse = ((y_data[None, :] - a[:, None] * basis - c[:, None]) ** 2).sum(axis=1)
+        sse[~np.isfinite(sse) | (np.abs(det) <= 1e-12 * s11 * n)] = np.inf
+    best = np.argmin(sse)
+    if not np.isfinite(sse[best]):
+        return None
+    return np.array([a[best], EXPONENTIAL_RATES[best] / span, c[best]])
+
+
+def _fit_exponential_one(y_data):
+    start = exponential_start(y_data)
+    x_data = np.arange(len(y_data))
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", OptimizeWarning)
+            params, _ = curve_fit(exponential_func, x_data, y_data, p0=(1, 0.01, 1) if start is None else start, maxfev=2000)
+        return params, ITERATIVE
+    except RuntimeError:
+        if start is None:
+            raise
+        return start, LINEARIZED
+
+
+def fit_exponential(y, lengths):
+    """a * exp(b * x) + c: curve_fit started from the linearized estimate, which it falls back to if it does not converge.
+
+    curve_fit holds the GIL, so the series are fitted one after another.
+    """
+    results = [_fit_exponential_one(y[i, :lengths[i]]) for i in range(len(lengths))]
+    params = np.array([params for params, _ in results]).reshape(len(lengths), 3)
+    return params, [method for _, method in results]
@@ -0,0 +1,75 @@
+import gc
+import os
+import sys
+import tempfile
+
+# Production entry point: `gunicorn app:app` from this directory picks up this file; for the ASGI mode
+# (asgi.py) run `gunicorn asgi:app -k uvicorn_worker.UvicornWorker`, where each worker serves on one event loop.
+#   kill -HUP <master pid>   reloads the code and the sales engine snapshot, then replaces the workers gracefully
+#   kill -TTIN / -TTOU       adds / removes a worker
+# Each worker opens its own connection pool on first use, so Postgres has to allow
+# WEB_CONCURRENCY * DB_POOL_MAX_SIZE connections (plus the sales engine listener per worker).
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+# Flask runs each async view on an event loop of its own, so threads give a worker concurrent requests
+# (-k replaces the worker class for the ASGI mode, whose workers ignore threads)
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 4))
+# Workers are recycled after this many requests; the jitter keeps them from restarting together
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+timeout = int(os.getenv("WEB_TIMEOUT", 300))  # Seconds; synchronous Excel exports of large ranges are slow
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+accesslog = "-"
+
+# Each worker writes its metrics to a file here, so /metrics on any worker reports the sum over all of them
+if not os.getenv("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="booksales-metrics-")
+
+
+def _preload(server):
+    # The master maps the sales engine snapshot and indexes it once; forked workers share those pages and
+    # keep only newer sales of their own (see sales_engine.preload). Nothing imported here opens a
+    # connection or starts a thread.
+    import sales_engine
+    sales_engine.preload()
+    # Objects created so far are never collected, so the collector does not copy their pages into each worker
+    gc.freeze()
+    server.log.info(f"Preloaded sales engine: {sales_engine.stats()}")
+
+
+def when_ready(server):
+    import metrics
+    metrics.clear()  # Series of an earlier run would be summed with this one's
+    _preload(server)
+
+
+def on_reload(server):
+    # New workers fork from the master, so forget the project modules it imported to load the current code
+    gc.unfreeze()
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.dirname(os.path.abspath(path)) == PROJECT_DIR and not name.startswith("__"):
+            del sys.modules[name]
+    _preload(server)
+
+
+def worker_exit(server, worker):
+    # Runs in the worker: write what it counted since its last flush
+    import metrics
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    # Runs in the master once a worker is gone: keep its counts, drop its file
+    import metrics
+    metrics.retire(worker.pid)
+
+
+def on_exit(server):
+    import metrics
+    metrics.clear()
@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+from cache import cache_key
+from exports import EXPORTS, ExportError
+
+# Background export settings
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", 2))  # Exports generated at the same time
+EXPORT_JOB_MAX_PENDING = int(os.getenv("EXPORT_JOB_MAX_PENDING", 20))  # Queued or running jobs before new ones are refused
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "booksales-exports")
+EXPORT_CACHE_TTL = float(os.getenv("EXPORT_CACHE_TTL", 3600))  # Seconds a finished export can be downloaded
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class ExportJob:
+    """One export request. The id is derived from the export and its parameters, so identical requests share a job."""
+
+    def __init__(self, job_id, export, args, download_name=None):
+        self.id = job_id
+        self.export = export
+        self.args = args
+        self.status = QUEUED
+        self.stage = None
+        self.error = None
+        self.error_status = None
+        self.download_name = download_name
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def path(self):
+        return result_path(self.id)
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "export": self.export,
+            "status": self.status,
+            "stage": self.stage,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "finishedAt": self.finished_at,
+            "expiresAt": self.finished_at + EXPORT_CACHE_TTL if self.status == DONE else None,
+        }
+
+
+_jobs = {}
+_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=EXPORT_JOB_WORKERS, thread_name_prefix="export-job")
+    return _executor
+
+
+def job_id(export, args):
+    return hashlib.sha1(cache_key(export, args).encode()).hexdigest()[:20]
+
+
+def result_path(job_id):
+    return os.path.join(EXPORT_CACHE_DIR, f"{job_id}.xlsx")
+
+
+def state_path(job_id):
+    return os.path.join(EXPORT_CACHE_DIR, f"{job_id}.json")
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _save_state(job):
+    """Record the job next to its result, so every server worker can report the jobs any of them runs."""
+    state = {**job.to_dict(), "errorStatus": job.error_status, "downloadName": job.download_name, "pid": os.getpid()}
+    try:
+        os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=EXPORT_CACHE_DIR, suffix=".part", delete=False) as part:
+            json.dump(state, part)
+        os.replace(part.name, state_path(job.id))
+    except OSError as e:
+        logging.error(f"Could not record the state of export job {job.id}: {e}")
+
+
+def _load_state(job_key):
+    """A job recorded by another process, or None when there is none, it expired or its process died."""
+    try:
+        with open(state_path(job_key)) as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
+        return None
+    if state["status"] in (QUEUED, RUNNING) and not _alive(state["pid"]):
+        return None
+    if state["status"] == DONE and not _fresh(result_path(job_key)):
+        return None
+    if state["status"] == FAILED and time.time() - state["finishedAt"] >= EXPORT_CACHE_TTL:
+        return None
+    job = ExportJob(job_key, state["export"], None, state["downloadName"])
+    job.status, job.stage, job.error, job.error_status = state["status"], state["stage"], state["error"], state["errorStatus"]
+    job.created_at, job.finished_at = state["createdAt"], state["finishedAt"]
+    return job
+
+
+def _in_progress(path):
+    """A job state file of a queued or running job whose process is still alive."""
+    try:
+        with open(path) as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
+        return False
+    return state["status"] in (QUEUED, RUNNING) and _alive(state["pid"])
+
+
+def _fresh(path):
+    """A finished export on disk that has not expired yet."""
+    try:
+        return time.time() - os.path.getmtime(path) < EXPORT_CACHE_TTL
+    except OSError:
+        return False
+
+
+def purge_expired():
+    """Delete expired export files and forget their jobs."""
+    with _lock:
+        for job in list(_jobs.values()):
+            if job.status in (DONE, FAILED) and time.time() - job.finished_at >= EXPORT_CACHE_TTL:
+                del _jobs[job.id]
+    if not os.path.isdir(EXPORT_CACHE_DIR):
+        return
+    for name in os.listdir(EXPORT_CACHE_DIR):
+        path = os.path.join(EXPORT_CACHE_DIR, name)
+        # Jobs record their state as they go, but a stage can take longer than EXPORT_CACHE_TTL
+        if name.endswith((".xlsx", ".json")) and not _fresh(path) and not _in_progress(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.error(f"Could not remove expired export {path}: {e}")
+
+
+async def submit(export, args):
+    """Start an export in the background, or return the job already running or finished for the same request.
+
+    A finished export is only reused when it was started after the last change to the sales.
+    """
+    if export not in EXPORTS:
+        raise KeyError(export)
+    purge_expired()
+    job_key = job_id(export, args)
+    changed_at = await cache.last_invalidation()
+
+    with _lock:
+        job = _jobs.get(job_key)
+        if job is not None and (
+            job.status in (QUEUED, RUNNING) or (job.status == DONE and job.created_at > changed_at and _fresh(job.path))
+        ):
+            return job
+
+        # Queued, running or finished in another server worker
+        job = _load_state(job_key)
+        if job is not None and (job.status in (QUEUED, RUNNING) or (job.status == DONE and job.created_at > changed_at)):
+            return job
+
+        # Finished by an earlier process: only the file is left
+        if job is None and _fresh(result_path(job_key)) and os.path.getmtime(result_path(job_key)) > changed_at:
+            job = ExportJob(job_key, export, args)
+            job.status = DONE
+            job.finished_at = os.path.getmtime(job.path)
+            _jobs[job_key] = job
+            return job
+
+        pending = sum(1 for job in _jobs.values() if job.status in (QUEUED, RUNNING))
+        if pending >= EXPORT_JOB_MAX_PENDING:
+            raise JobQueueFull(f"Too many exports in progress ({pending}). Try again later.")
+
+        job = ExportJob(job_key, export, args.copy())
+        _jobs[job_key] = job
+    _save_state(job)
+
+    _get_executor().submit(_run, job)
+    return job
+
+
+def get(job_key):
+    with _lock:
+        job = _jobs.get(job_key)
+    if job is None:
+        job = _load_state(job_key)
+    if job is None and _fresh(result_path(job_key)):
+        # Finished by an earlier process
+        job = ExportJob(job_key, None, None)
+        job.status = DONE
+        job.finished_at = os.path.getmtime(job.path)
+    return job
+
+
+def _set_stage(job, stage):
+    job.stage = stage
+    _save_state(job)
+
+
+def _run(job):
+    job.status = RUNNING
+    _save_state(job)
+    try:
+        # The builders are coroutines; each job gets its own loop on the worker thread
+        output, job.download_name = asyncio.run(EXPORTS[job.export](job.args, lambda stage: _set_stage(job, stage)))
+        job.stage = "saving"
+        os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+        with output, tempfile.NamedTemporaryFile(dir=EXPORT_CACHE_DIR, suffix=".part", delete=False) as part:
+            shutil.copyfileobj(output, part)
+        os.replace(part.name, job.path)
+        job.status = DONE
+    except ExportError as e:
+        job.status, job.error, job.error_status = FAILED, str(e), e.status
+    except Exception as e:
+        logging.error(f"Error: export job {job.id} failed: {e}")
+        job.status, job.error, job.error_status = FAILED, f"An error occurred: {e}", 500
+    finally:
+        job.stage = None
+        job.finished_at = time.time()
+        _save_state(job)
@@ -0,0 +1,348 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from flask import g, has_request_context, request
+
+# Metrics settings; with METRICS=off no hooks are installed and stage() is a shared no-op
+METRICS_ENABLED = os.getenv("METRICS", "on").lower() != "off"
+METRICS_PREFIX = "booksales_"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# With several processes serving the app (gunicorn workers), each writes its series to a file in METRICS_DIR
+# every METRICS_FLUSH_INTERVAL seconds and /metrics in any of them serves the sum over all the files. The
+# series of exited processes are folded into RETIRED (see retire), so recycling a worker keeps its counts.
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))  # Seconds
+RETIRED = "retired.json"
+
+# Route label for work done outside a request, e.g. background export jobs
+BACKGROUND_ROUTE = "background"
+
+# Route of the current request when it is not served by Flask; asgi.py sets it per request
+request_route = ContextVar("request_route", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """A Prometheus counter with a fixed set of label names."""
+
+    def __init__(self, name, description, labels=()):
+        self.name = METRICS_PREFIX + name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        """The value of every series, by label values."""
+        with self._lock:
+            return dict(self._values)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def add(total, values):
+        """Add the series in values, as returned by collect, to those in total."""
+        for label_values, value in values.items():
+            total[label_values] = total.get(label_values, 0) + value
+
+    def render(self, values=None):
+        """The series in values (by default those of this process) in the exposition format."""
+        values = self.collect() if values is None else values
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """A Prometheus histogram with a fixed set of label names and bucket bounds."""
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = METRICS_PREFIX + name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self):
+        """The bucket counts, sum and count of every series, by label values."""
+        with self._lock:
+            return {label_values: list(series) for label_values, series in self._series.items()}
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    @staticmethod
+    def add(total, values):
+        """Add the series in values, as returned by collect, to those in total."""
+        for label_values, series in values.items():
+            current = total.get(label_values)
+            total[label_values] = list(series) if current is None else [a + b for a, b in zip(current, series)]
+
+    def render(self, values=None):
+        """The series in values (by default those of this process) in the exposition format."""
+        values = self.collect() if values is None else values
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, label_values, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labels, label_values, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce a response (streamed bodies are not included).",
+    ("route", "method", "status"),
+)
+RESPONSE_BYTES = Histogram(
+    "http_response_size_bytes",
+    "Size of non-streamed response bodies.",
+    ("route",),
+    SIZE_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds",
+    "Time spent per stage of a request: db, engine, processing, fitting or excel.",
+    ("route", "stage"),
+)
+DB_ROWS = Counter(
+    "db_rows_returned_total",
+    "Rows returned by database queries.",
+    ("route", "statement"),
+)
+
+METRICS = [REQUEST_SECONDS, RESPONSE_BYTES, STAGE_SECONDS, DB_ROWS]
+
+
+def current_route():
+    """The URL rule of the current request, or BACKGROUND_ROUTE outside of one."""
+    route = request_route.get()
+    if route is not None:
+        return route
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return BACKGROUND_ROUTE
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.route = current_route()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, self.route, self.name)
+        return False
+
+
+_NOOP = nullcontext()
+
+
+def stage(name):
+    """Time a block as one stage of the current request: `with metrics.stage("db"): ...`.
+
+    Stages may nest; the enclosing stage then includes the time of those inside it.
+    """
+    return _Stage(name) if METRICS_ENABLED else _NOOP
+
+
+def count_rows(statement, rows):
+    if METRICS_ENABLED:
+        DB_ROWS.inc(rows, current_route(), statement)
+
+
+def _read(path):
+    """The series stored at path, by metric name and label values."""
+    with open(path) as series_file:
+        stored = json.load(series_file)
+    return {
+        name: {tuple(label_values): value for label_values, value in series}
+        for name, series in stored["series"].items()
+    }, stored.get("retired", [])
+
+
+def _write(path, series, retired=None):
+    stored = {
+        "series": {
+            name: [[list(label_values), value] for label_values, value in values.items()]
+            for name, values in series.items()
+        }
+    }
+    if retired is not None:
+        stored["retired"] = retired
+    staging = path + ".tmp"
+    with open(staging, "w") as series_file:
+        json.dump(stored, series_file)
+    os.replace(staging, path)  # Readers see the old file or the new one, never half of one
+
+
+def _read_retired():
+    try:
+        return _read(os.path.join(METRICS_DIR, RETIRED))
+    except FileNotFoundError:
+        return {}, []
+
+
+_process_file = None  # This process' file in METRICS_DIR, named by pid and start time as pids get reused
+_flusher_pid = None
+
+
+def flush():
+    """Write the series of this process to its file in METRICS_DIR."""
+    global _process_file
+    if _process_file is None or not os.path.basename(_process_file).startswith(f"{os.getpid()}-"):
+        _process_file = os.path.join(METRICS_DIR, f"{os.getpid()}-{time.time_ns()}.json")
+    _write(_process_file, {metric.name: metric.collect() for metric in METRICS})
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError as e:
+            logging.error(f"Could not write metrics to {METRICS_DIR}: {e}")
+
+
+def start_flushing():
+    """With METRICS_DIR set, flush this process' series every METRICS_FLUSH_INTERVAL seconds."""
+    global _flusher_pid
+    if METRICS_DIR and _flusher_pid != os.getpid():
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True).start()
+
+
+def _collect_processes():
+    """The series of every process sharing METRICS_DIR, this one included, summed by metric name."""
+    flush()
+    processes = {}
+    for entry in os.listdir(METRICS_DIR):
+        if entry.endswith(".json") and entry != RETIRED:
+            try:
+                processes[entry] = _read(os.path.join(METRICS_DIR, entry))[0]
+            except FileNotFoundError:
+                pass  # Retired meanwhile, so RETIRED (read next) holds its series
+    # Read last: a file retired after it was read above is listed in RETIRED and skipped, not counted twice
+    retired_series, retired = _read_retired()
+    totals = {metric.name: {} for metric in METRICS}
+    for entry, series in [(RETIRED, retired_series), *processes.items()]:
+        if entry in retired:
+            continue
+        for metric in METRICS:
+            metric.add(totals[metric.name], series.get(metric.name, {}))
+    return totals
+
+
+def retire(pid):
+    """Fold the series of an exited process into RETIRED; called by the gunicorn master as a worker exits."""
+    for entry in os.listdir(METRICS_DIR):
+        if entry.startswith(f"{pid}-") and entry.endswith(".json"):
+            path = os.path.join(METRICS_DIR, entry)
+            totals, retired = _read_retired()
+            series, _ = _read(path)
+            for metric in METRICS:
+                totals.setdefault(metric.name, {})
+                metric.add(totals[metric.name], series.get(metric.name, {}))
+            # Listed so that readers which still found the file skip it, then removed
+            _write(os.path.join(METRICS_DIR, RETIRED), totals, retired + [entry])
+            os.remove(path)
+
+
+def clear():
+    """Remove the series files in METRICS_DIR, e.g. those left by an earlier run of the server."""
+    for entry in os.listdir(METRICS_DIR):
+        if entry.endswith((".json", ".tmp")):
+            os.remove(os.path.join(METRICS_DIR, entry))
+
+
+def _forget():
+    # A forked child starts counting from zero: its parent's series are the parent's to report
+    for metric in METRICS:
+        metric.clear()
+
+
+if METRICS_DIR:
+    os.register_at_fork(after_in_child=_forget)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format, summed over every process with METRICS_DIR set."""
+    totals = _collect_processes() if METRICS_DIR else {}
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render(totals.get(metric.name)))
+    return "\n".join(lines) + "\n"
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _record_response(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        route = current_route()
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method, response.status_code)
+        if not response.is_streamed:
+            RESPONSE_BYTES.observe(response.calculate_content_length() or 0, route)
+    return response
+
+
+def init_app(app):
+    """Time every request and serve the metrics at /metrics."""
+    if not METRICS_ENABLED:
+        return
+    start_flushing()
+    app.before_request(_start_timer)
+    app.after_request(_record_response)
+    app.add_url_rule(
+        "/metrics",
+        "metrics",
+        lambda: app.response_class(render(), mimetype="text/plain; version=0.0.4"),
+    )
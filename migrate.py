@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import os
+import re
+
+import asyncpg
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+DB_URL = os.getenv("DB_URL")
+
+# Migrations are numbered SQL files (0001_create_tables.sql, ...) applied in order, each in its own transaction
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Held while migrating so two deployments cannot apply the same migration at once
+MIGRATION_LOCK_ID = 0x5a1e5
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Return [(version, name, path)] sorted by version."""
+    migrations = []
+    for file_name in os.listdir(directory):
+        match = MIGRATION_FILE.match(file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, file_name)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+async def applied_versions(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    return {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations;")}
+
+
+async def migrate(target=None, baseline=None, status=False, dsn=DB_URL):
+    """Apply pending migrations up to target (all by default).
+
+    baseline records every migration up to that version as applied without running it,
+    for databases that were created from the old create-tables-script.sql.
+    """
+    migrations = load_migrations()
+    conn = await asyncpg.connect(dsn=dsn)
+    try:
+        await conn.execute("SELECT pg_advisory_lock($1);", MIGRATION_LOCK_ID)
+        applied = await applied_versions(conn)
+
+        if status:
+            for version, name, _ in migrations:
+                print(f"{version:04d} {name}: {'applied' if version in applied else 'pending'}")
+            return
+
+        for version, name, path in migrations:
+            if version in applied or (target is not None and version > target):
+                continue
+
+            async with conn.transaction():
+                if baseline is not None and version <= baseline:
+                    print(f"Marking {version:04d} {name} as applied.")
+                else:
+                    with open(path, encoding="utf-8") as f:
+                        sql = f.read()
+                    print(f"Applying {version:04d} {name}...")
+                    await conn.execute(sql)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2);", version, name
+                )
+
+        print("Database schema is up to date.")
+    finally:
+        await conn.close()  # Also releases the advisory lock
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the SQL migrations in migrations/ to the database.")
+    parser.add_argument("--target", type=int, default=None, help="Last migration version to apply")
+    parser.add_argument("--baseline", type=int, default=None, help="Mark migrations up to this version as applied without running them")
+    parser.add_argument("--status", action="store_true", help="List migrations and whether they are applied")
+    parser.add_argument("--dsn", default=DB_URL, help="Database URL (defaults to DB_URL)")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.target, args.baseline, args.status, args.dsn))
@@ -23,7 +23,8 @@ CREATE TABLE clients (
     client_id SERIAL PRIMARY KEY,
     client_name VARCHAR(100),
     gender VARCHAR(10) CHECK (gender IN ('Male', 'Female', 'Other')),
-    age_group_id INT REFERENCES age_groups(age_group_id)
+    age_group_id INT REFERENCES age_groups(age_group_id),
+    age NUMERIC
 );
 
 -- Table for Books
@@ -55,6 +56,34 @@ CREATE TABLE events (
     CHECK (end_date >= start_date) -- Ensure the end date is not before the start date
 );
 
+-- Table for Cities (Romanian Cities)
+CREATE TABLE cities (
+    city_id SERIAL PRIMARY KEY,
+    city_name VARCHAR(100) NOT NULL UNIQUE,
+    latitude NUMERIC(9, 6),
+    longitude NUMERIC(9, 6)
+);
+
+-- Insert some Romanian cities
+INSERT INTO cities (city_name, latitude, longitude) VALUES
+    ('Bucharest', 44.4268, 26.1025),
+    ('Cluj-Napoca', 46.7712, 23.6236),
+    ('Timișoara', 45.7489, 21.2087),
+    ('Iași', 47.1585, 27.6014),
+    ('Constanța', 44.1598, 28.6348),
+    ('Craiova', 44.3302, 23.7949),
+    ('Galați', 45.4353, 28.0074),
+    ('Ploiești', 44.9364, 26.0373),
+    ('Brașov', 45.6438, 25.5887),
+    ('Oradea', 47.0722, 21.9214),
+    ('Suceava', 47.6342, 26.2592),
+    ('Baia Mare', 47.6573, 23.5681),
+    ('Satu Mare', 47.7921, 22.8857),
+    ('Dej', 47.1416, 23.8759),
+    ('Vatra Dornei', 47.3486, 25.3547),
+    ('Gura Humorului', 47.5637, 25.8889),
+    ('Dorohoi', 47.9531, 26.3973);
+
 -- Table for Sales
 CREATE TABLE sales (
     sale_id SERIAL PRIMARY KEY,
@@ -64,7 +93,8 @@ CREATE TABLE sales (
     quantity INT NOT NULL CHECK (quantity > 0),
     total_price NUMERIC(10, 2) NOT NULL,
     discount_id INT REFERENCES discounts(discount_id),
-    event_id INT REFERENCES events(event_id) -- Allow NULL for event_id, meaning no event
+    event_id INT REFERENCES events(event_id), -- Allow NULL for event_id, meaning no event
+    city_id INT REFERENCES cities(city_id) ON DELETE SET NULL
 );
 
 -- Table for Stock
@@ -82,60 +112,3 @@ CREATE TABLE stock_history (
     change_quantity INT NOT NULL,
     reason VARCHAR(255)
 );
-
-
-
--- Table for Cities (Romanian Cities)
-CREATE TABLE cities (
-    city_id SERIAL PRIMARY KEY,
-    city_name VARCHAR(100) NOT NULL UNIQUE
-);
-
--- Insert some Romanian cities
-INSERT INTO cities (city_name) VALUES 
-    ('Bucharest'),
-    ('Cluj-Napoca'),
-    ('Timișoara'),
-    ('Iași'),
-    ('Constanța'),
-    ('Craiova'),
-    ('Galați'),
-    ('Ploiești'),
-    ('Brașov'),
-    ('Oradea'),
-	('Suceava'),
-	('Baia Mare'),
-	('Satu Mare'),
-	('Dej'),
-	('Vatra Dornei'),
-	('Gura Humorului'),
-	('Dorohoi')
-
--- Modify Sales Table to Include city_id
-ALTER TABLE sales
-ADD COLUMN city_id INT REFERENCES cities(city_id) ON DELETE SET NULL;
-
-alter table clients add column age NUMERIC
-
-ALTER TABLE cities
-ADD COLUMN latitude NUMERIC(9, 6),
-ADD COLUMN longitude NUMERIC(9, 6);
-
-
-UPDATE cities SET latitude = 44.4268, longitude = 26.1025 WHERE city_name = 'Bucharest';
-UPDATE cities SET latitude = 46.7712, longitude = 23.6236 WHERE city_name = 'Cluj-Napoca';
-UPDATE cities SET latitude = 45.7489, longitude = 21.2087 WHERE city_name = 'Timișoara';
-UPDATE cities SET latitude = 47.1585, longitude = 27.6014 WHERE city_name = 'Iași';
-UPDATE cities SET latitude = 44.1598, longitude = 28.6348 WHERE city_name = 'Constanța';
-UPDATE cities SET latitude = 44.3302, longitude = 23.7949 WHERE city_name = 'Craiova';
-UPDATE cities SET latitude = 45.4353, longitude = 28.0074 WHERE city_name = 'Galați';
-UPDATE cities SET latitude = 44.9364, longitude = 26.0373 WHERE city_name = 'Ploiești';
-UPDATE cities SET latitude = 45.6438, longitude = 25.5887 WHERE city_name = 'Brașov';
-UPDATE cities SET latitude = 47.0722, longitude = 21.9214 WHERE city_name = 'Oradea';
-UPDATE cities SET latitude = 47.6342, longitude = 26.2592 WHERE city_name = 'Suceava';
-UPDATE cities SET latitude = 47.6573, longitude = 23.5681 WHERE city_name = 'Baia Mare';
-UPDATE cities SET latitude = 47.7921, longitude = 22.8857 WHERE city_name = 'Satu Mare';
-UPDATE cities SET latitude = 47.1416, longitude = 23.8759 WHERE city_name = 'Dej';
-UPDATE cities SET latitude = 47.3486, longitude = 25.3547 WHERE city_name = 'Vatra Dornei';
-UPDATE cities SET latitude = 47.5637, longitude = 25.8889 WHERE city_name = 'Gura Humorului';
-UPDATE cities SET latitude = 47.9531, longitude = 26.3973 WHERE city_name = 'Dorohoi';
@@ -0,0 +1,32 @@
+-- Every endpoint filters sales by a sale_date range and joins clients, books and cities from the matching rows.
+-- Keyed on (sale_date, sale_id) it also serves the keyset pagination and ORDER BY sale_date of fetch-sales;
+-- the included columns let the aggregate endpoints use index-only scans.
+CREATE INDEX IF NOT EXISTS sales_sale_date_covering_idx
+    ON sales (sale_date, sale_id)
+    INCLUDE (book_id, client_id, city_id, quantity, total_price);
+
+-- fetch-sales-trend only reads discounted sales
+CREATE INDEX IF NOT EXISTS sales_discounted_sale_date_idx
+    ON sales (sale_date)
+    INCLUDE (discount_id, client_id, city_id, total_price)
+    WHERE discount_id IS NOT NULL;
+
+-- Event endpoints join sales on event_id
+CREATE INDEX IF NOT EXISTS sales_event_covering_idx
+    ON sales (event_id)
+    INCLUDE (book_id, client_id, quantity, total_price)
+    WHERE event_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS events_start_date_idx ON events (start_date);
+
+-- Foreign keys, for joins from the dimension side and for cascading deletes
+CREATE INDEX IF NOT EXISTS sales_client_id_idx ON sales (client_id);
+CREATE INDEX IF NOT EXISTS sales_book_id_idx ON sales (book_id);
+CREATE INDEX IF NOT EXISTS sales_city_id_idx ON sales (city_id);
+CREATE INDEX IF NOT EXISTS sales_discount_id_idx ON sales (discount_id) WHERE discount_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS books_subcategory_id_idx ON books (subcategory_id);
+CREATE INDEX IF NOT EXISTS subcategories_category_id_idx ON subcategories (category_id);
+CREATE INDEX IF NOT EXISTS clients_age_group_id_idx ON clients (age_group_id);
+CREATE INDEX IF NOT EXISTS stock_history_stock_id_idx ON stock_history (stock_id);
+
+ANALYZE sales;
@@ -0,0 +1,120 @@
+-- sales becomes a table partitioned by sale_date, so date-bounded queries only scan the partitions in range
+-- and old partitions can be detached (see partitions.py). Existing rows are copied into the new table.
+
+-- Partitions of sales_default are created on demand, one per year (unit 'year') or month (unit 'month')
+CREATE OR REPLACE FUNCTION create_sales_partitions(from_day DATE, to_day DATE, unit TEXT DEFAULT 'year') RETURNS INT AS $$
+DECLARE
+    step INTERVAL := ('1 ' || unit)::INTERVAL;
+    lower_bound DATE := DATE_TRUNC(unit, from_day)::DATE;
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    IF unit NOT IN ('year', 'month') THEN
+        RAISE EXCEPTION 'Partition unit must be year or month, not %', unit;
+    END IF;
+
+    WHILE lower_bound <= to_day LOOP
+        partition_name := 'sales_' || CASE unit WHEN 'year' THEN TO_CHAR(lower_bound, '"y"YYYY') ELSE TO_CHAR(lower_bound, '"y"YYYY"m"MM') END;
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE FORMAT(
+                'CREATE TABLE %I PARTITION OF sales FOR VALUES FROM (%L) TO (%L)',
+                partition_name, lower_bound, (lower_bound + step)::DATE
+            );
+            created := created + 1;
+        END IF;
+        lower_bound := (lower_bound + step)::DATE;
+    END LOOP;
+
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE sales RENAME TO sales_unpartitioned;
+ALTER TABLE sales_unpartitioned RENAME CONSTRAINT sales_pkey TO sales_unpartitioned_pkey;
+ALTER SEQUENCE sales_sale_id_seq OWNED BY NONE;
+
+-- The primary key has to contain the partition key; sale_id stays unique through its sequence
+CREATE TABLE sales (
+    sale_id INT NOT NULL DEFAULT nextval('sales_sale_id_seq'),
+    book_id INT REFERENCES books(book_id) ON DELETE CASCADE,
+    client_id INT REFERENCES clients(client_id),
+    sale_date DATE NOT NULL,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    total_price NUMERIC(10, 2) NOT NULL,
+    discount_id INT REFERENCES discounts(discount_id),
+    event_id INT REFERENCES events(event_id), -- Allow NULL for event_id, meaning no event
+    city_id INT REFERENCES cities(city_id) ON DELETE SET NULL,
+    PRIMARY KEY (sale_id, sale_date)
+) PARTITION BY RANGE (sale_date);
+
+ALTER SEQUENCE sales_sale_id_seq OWNED BY sales.sale_id;
+
+-- Rows outside every partition land here; create_sales_partitions cannot cover dates it already holds
+CREATE TABLE sales_default PARTITION OF sales DEFAULT;
+
+SELECT create_sales_partitions(
+    LEAST(COALESCE(MIN(sale_date), CURRENT_DATE), CURRENT_DATE),
+    (CURRENT_DATE + INTERVAL '1 year')::DATE
+) FROM sales_unpartitioned;
+
+INSERT INTO sales (sale_id, book_id, client_id, sale_date, quantity, total_price, discount_id, event_id, city_id)
+SELECT sale_id, book_id, client_id, sale_date, quantity, total_price, discount_id, event_id, city_id
+FROM sales_unpartitioned;
+
+-- Triggers of the former create-rollup-script.sql and create-cache-invalidation-script.sql (now 0004 and
+-- 0005) move to the new table
+DO $$
+DECLARE
+    old_triggers TEXT[] := ARRAY(
+        SELECT tgname::TEXT FROM pg_trigger WHERE tgrelid = 'sales_unpartitioned'::REGCLASS AND NOT tgisinternal
+    );
+BEGIN
+    IF 'sales_rollup_insert' = ANY(old_triggers) THEN
+        CREATE TRIGGER sales_rollup_insert
+            AFTER INSERT ON sales
+            REFERENCING NEW TABLE AS new_sales
+            FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_on_insert();
+    END IF;
+    IF 'sales_rollup_update' = ANY(old_triggers) THEN
+        CREATE TRIGGER sales_rollup_update
+            AFTER UPDATE ON sales
+            REFERENCING OLD TABLE AS old_sales NEW TABLE AS new_sales
+            FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_on_change();
+    END IF;
+    IF 'sales_rollup_delete' = ANY(old_triggers) THEN
+        CREATE TRIGGER sales_rollup_delete
+            AFTER DELETE ON sales
+            REFERENCING OLD TABLE AS old_sales
+            FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_on_change();
+    END IF;
+    IF 'sales_changed_notify' = ANY(old_triggers) THEN
+        CREATE TRIGGER sales_changed_notify
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sales
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_sales_changed();
+    END IF;
+END;
+$$;
+
+-- The indexes of 0002_sales_indexes.sql are dropped with the old table and rebuilt on every partition
+DROP TABLE sales_unpartitioned;
+
+CREATE INDEX IF NOT EXISTS sales_sale_date_covering_idx
+    ON sales (sale_date, sale_id)
+    INCLUDE (book_id, client_id, city_id, quantity, total_price);
+
+CREATE INDEX IF NOT EXISTS sales_discounted_sale_date_idx
+    ON sales (sale_date)
+    INCLUDE (discount_id, client_id, city_id, total_price)
+    WHERE discount_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS sales_event_covering_idx
+    ON sales (event_id)
+    INCLUDE (book_id, client_id, quantity, total_price)
+    WHERE event_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS sales_client_id_idx ON sales (client_id);
+CREATE INDEX IF NOT EXISTS sales_book_id_idx ON sales (book_id);
+CREATE INDEX IF NOT EXISTS sales_city_id_idx ON sales (city_id);
+CREATE INDEX IF NOT EXISTS sales_discount_id_idx ON sales (discount_id) WHERE discount_id IS NOT NULL;
+
+ANALYZE sales;
@@ -0,0 +1,13 @@
+-- Notify the API whenever sales are written, so cached results are dropped
+-- (formerly create-cache-invalidation-script.sql; rerunning it on such a database changes nothing)
+CREATE OR REPLACE FUNCTION notify_sales_changed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('sales_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sales_changed_notify ON sales;
+CREATE TRIGGER sales_changed_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sales
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_sales_changed();
@@ -0,0 +1,166 @@
+-- Sales without a client get rollup rows of their own: the subcategory statements inner join clients, and
+-- gender '' alone cannot tell them from clients without a gender.
+ALTER TABLE sales_daily_rollup ADD COLUMN IF NOT EXISTS has_client BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE sales_daily_rollup DROP CONSTRAINT IF EXISTS sales_daily_rollup_pkey;
+ALTER TABLE sales_daily_rollup
+    ADD PRIMARY KEY (day, city_id, category_id, subcategory_id, gender, age_group_id, discount_id, event_id, has_client);
+
+CREATE OR REPLACE FUNCTION rebuild_sales_rollup_days(days DATE[]) RETURNS VOID AS $$
+BEGIN
+    DELETE FROM sales_daily_rollup WHERE day IN (SELECT unnest(days));
+
+    INSERT INTO sales_daily_rollup (
+        day, city_id, category_id, subcategory_id, gender, age_group_id, discount_id, event_id, has_client,
+        total_price, quantity, sale_count, min_price, max_price
+    )
+    SELECT
+        s.sale_date,
+        COALESCE(s.city_id, 0),
+        COALESCE(sub.category_id, 0),
+        COALESCE(b.subcategory_id, 0),
+        COALESCE(cl.gender, ''),
+        COALESCE(cl.age_group_id, 0),
+        COALESCE(s.discount_id, 0),
+        COALESCE(s.event_id, 0),
+        cl.client_id IS NOT NULL,
+        SUM(s.total_price),
+        SUM(s.quantity),
+        COUNT(*),
+        MIN(s.total_price),
+        MAX(s.total_price)
+    FROM sales s
+    LEFT JOIN clients cl ON s.client_id = cl.client_id
+    LEFT JOIN books b ON s.book_id = b.book_id
+    LEFT JOIN subcategories sub ON b.subcategory_id = sub.subcategory_id
+    WHERE s.sale_date IN (SELECT unnest(days))
+    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_rollup_on_insert() RETURNS TRIGGER AS $$
+BEGIN
+    IF sales_rollup_deferred() THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO sales_daily_rollup AS r (
+        day, city_id, category_id, subcategory_id, gender, age_group_id, discount_id, event_id, has_client,
+        total_price, quantity, sale_count, min_price, max_price
+    )
+    SELECT
+        s.sale_date,
+        COALESCE(s.city_id, 0),
+        COALESCE(sub.category_id, 0),
+        COALESCE(b.subcategory_id, 0),
+        COALESCE(cl.gender, ''),
+        COALESCE(cl.age_group_id, 0),
+        COALESCE(s.discount_id, 0),
+        COALESCE(s.event_id, 0),
+        cl.client_id IS NOT NULL,
+        SUM(s.total_price),
+        SUM(s.quantity),
+        COUNT(*),
+        MIN(s.total_price),
+        MAX(s.total_price)
+    FROM new_sales s
+    LEFT JOIN clients cl ON s.client_id = cl.client_id
+    LEFT JOIN books b ON s.book_id = b.book_id
+    LEFT JOIN subcategories sub ON b.subcategory_id = sub.subcategory_id
+    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+    ON CONFLICT (day, city_id, category_id, subcategory_id, gender, age_group_id, discount_id, event_id, has_client) DO UPDATE SET
+        total_price = r.total_price + EXCLUDED.total_price,
+        quantity = r.quantity + EXCLUDED.quantity,
+        sale_count = r.sale_count + EXCLUDED.sale_count,
+        min_price = LEAST(r.min_price, EXCLUDED.min_price),
+        max_price = GREATEST(r.max_price, EXCLUDED.max_price);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The rollup copies client genders and age groups, book subcategories and subcategory categories, so the days
+-- of the sales they apply to are rebuilt when those change. The notification drops results cached from the
+-- old rows; its payload is the table name, so listeners can tell it from a write to sales.
+CREATE OR REPLACE FUNCTION sales_rollup_on_client_change() RETURNS TRIGGER AS $$
+DECLARE
+    days DATE[] := ARRAY(
+        SELECT DISTINCT s.sale_date
+        FROM old_clients o
+        JOIN new_clients n ON n.client_id = o.client_id
+        JOIN sales s ON s.client_id = n.client_id
+        WHERE n.gender IS DISTINCT FROM o.gender OR n.age_group_id IS DISTINCT FROM o.age_group_id
+    );
+BEGIN
+    IF cardinality(days) > 0 THEN
+        IF NOT sales_rollup_deferred() THEN
+            PERFORM rebuild_sales_rollup_days(days);
+        END IF;
+        PERFORM pg_notify('sales_changed', TG_TABLE_NAME);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_rollup_on_book_change() RETURNS TRIGGER AS $$
+DECLARE
+    days DATE[] := ARRAY(
+        SELECT DISTINCT s.sale_date
+        FROM old_books o
+        JOIN new_books n ON n.book_id = o.book_id
+        JOIN sales s ON s.book_id = n.book_id
+        WHERE n.subcategory_id IS DISTINCT FROM o.subcategory_id
+    );
+BEGIN
+    IF cardinality(days) > 0 THEN
+        IF NOT sales_rollup_deferred() THEN
+            PERFORM rebuild_sales_rollup_days(days);
+        END IF;
+        PERFORM pg_notify('sales_changed', TG_TABLE_NAME);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_rollup_on_subcategory_change() RETURNS TRIGGER AS $$
+DECLARE
+    days DATE[] := ARRAY(
+        SELECT DISTINCT s.sale_date
+        FROM old_subcategories o
+        JOIN new_subcategories n ON n.subcategory_id = o.subcategory_id
+        JOIN books b ON b.subcategory_id = n.subcategory_id
+        JOIN sales s ON s.book_id = b.book_id
+        WHERE n.category_id IS DISTINCT FROM o.category_id
+    );
+BEGIN
+    IF cardinality(days) > 0 THEN
+        IF NOT sales_rollup_deferred() THEN
+            PERFORM rebuild_sales_rollup_days(days);
+        END IF;
+        PERFORM pg_notify('sales_changed', TG_TABLE_NAME);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables rule out an UPDATE OF column list, so the functions compare the columns themselves
+DROP TRIGGER IF EXISTS sales_rollup_client_update ON clients;
+CREATE TRIGGER sales_rollup_client_update
+    AFTER UPDATE ON clients
+    REFERENCING OLD TABLE AS old_clients NEW TABLE AS new_clients
+    FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_on_client_change();
+
+DROP TRIGGER IF EXISTS sales_rollup_book_update ON books;
+CREATE TRIGGER sales_rollup_book_update
+    AFTER UPDATE ON books
+    REFERENCING OLD TABLE AS old_books NEW TABLE AS new_books
+    FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_on_book_change();
+
+DROP TRIGGER IF EXISTS sales_rollup_subcategory_update ON subcategories;
+CREATE TRIGGER sales_rollup_subcategory_update
+    AFTER UPDATE ON subcategories
+    REFERENCING OLD TABLE AS old_subcategories NEW TABLE AS new_subcategories
+    FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_on_subcategory_change();
+
+-- Existing rows were all counted as having a client; rebuild them with the new key
+SELECT refresh_sales_rollup(MIN(sale_date), MAX(sale_date)) FROM sales;
+ALTER TABLE sales_daily_rollup ALTER COLUMN has_client DROP DEFAULT;
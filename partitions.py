@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+from datetime import date, timedelta
+
+import asyncpg
+
+from migrate import DB_URL
+
+# Partitions are kept this many days ahead of today, so new sales never fall into sales_default
+PARTITION_DAYS_AHEAD = 400
+
+
+async def list_partitions(conn):
+    """Return [(name, bounds)] for the partitions of sales, oldest first."""
+    return await conn.fetch("""
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bounds
+        FROM pg_inherits i
+        INNER JOIN pg_class c ON i.inhrelid = c.oid
+        WHERE i.inhparent = 'sales'::regclass
+        ORDER BY c.relname;
+    """)
+
+
+async def ensure_partitions(conn, unit="year", days_ahead=PARTITION_DAYS_AHEAD, start_date=None):
+    """Create the partitions missing between start_date (today by default) and days_ahead days from now."""
+    start_date = start_date or date.today()
+    end_date = max(start_date, date.today() + timedelta(days=days_ahead))
+    created = await conn.fetchval("SELECT create_sales_partitions($1, $2, $3);", start_date, end_date, unit)
+    print(f"Created {created} sales partitions up to {end_date}.")
+
+
+async def detach_partitions(conn, before):
+    """Detach the partitions holding only sales before a date; they remain as plain tables to archive or drop.
+
+    The daily rollup keeps their totals until refresh_sales_rollup() is run for those days.
+    """
+    rows = await conn.fetch("""
+        SELECT c.relname AS name
+        FROM pg_inherits i
+        INNER JOIN pg_class c ON i.inhrelid = c.oid
+        WHERE i.inhparent = 'sales'::regclass
+            AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'
+            AND (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([0-9-]+)''\\)'))[1]::DATE <= $1
+        ORDER BY c.relname;
+    """, before)
+    for row in rows:
+        await conn.execute(f'ALTER TABLE sales DETACH PARTITION "{row["name"]}";')
+        print(f"Detached {row['name']}.")
+    if not rows:
+        print(f"No partitions end before {before}.")
+
+
+async def main(args):
+    conn = await asyncpg.connect(dsn=args.dsn)
+    try:
+        if args.list:
+            for row in await list_partitions(conn):
+                print(f"{row['name']}: {row['bounds']}")
+        elif args.detach_before:
+            await detach_partitions(conn, args.detach_before)
+        else:
+            await ensure_partitions(conn, args.unit, args.days_ahead, args.start)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create future sales partitions (run daily, e.g. from cron), list or detach them.")
+    parser.add_argument("--unit", choices=["year", "month"], default="year", help="Partition size for new partitions")
+    parser.add_argument("--days-ahead", type=int, default=PARTITION_DAYS_AHEAD, help="Days after today to cover with partitions")
+    parser.add_argument("--start", type=date.fromisoformat, default=None, help="First day to cover (YYYY-MM-DD, defaults to today)")
+    parser.add_argument("--list", action="store_true", help="List the partitions and their bounds")
+    parser.add_argument("--detach-before", type=date.fromisoformat, default=None, help="Detach partitions ending on or before this day (YYYY-MM-DD)")
+    parser.add_argument("--dsn", default=DB_URL, help="Database URL (defaults to DB_URL)")
+    asyncio.run(main(parser.parse_args()))
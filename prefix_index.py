@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+
+# Running daily totals for date-range sums in constant time; SALES_PREFIX_INDEX=off answers from the sales columns
+PREFIX_INDEX_ENABLED = os.getenv("SALES_PREFIX_INDEX", "on").lower() != "off"
+
+
+class PrefixIndex:
+    """Cumulative daily sales per (discount, city, gender) group over a run of sales rows.
+
+    Every (group, day) with sales has one entry, sorted by group and day, and all entries share flat arrays of
+    running totals, so the index grows with the sales rather than with the days each group spans. The sum of
+    a group over any day range is the difference of two binary searches. Discount 0, city 0 and gender 0
+    stand for NULL / unknown.
+    Ages are not indexed, since the endpoints filter on arbitrary age ranges; those requests scan the columns.
+
+    An index covers the rows start to stop of one segment of sales columns (facts holds just those rows), so
+    new sales get an index of their own and the totals of several indexes add up; see SalesStore.indexes.
+    """
+
+    def __init__(self, snapshot, facts, start=0):
+        self.start = start
+        self.rows = len(facts["sale_id"])
+        self.stop = start + self.rows
+        client = facts["client_id"]
+        gender = np.where(snapshot.client_exists[client], snapshot.client_gender[client], -1) + 1
+        self.genders = len(snapshot.genders) + 1
+        self.cities = int(facts["city_id"].max(initial=0)) + 1
+
+        key = (facts["discount_id"].astype(np.int64) * self.cities + facts["city_id"]) * self.genders + gender
+        groups, inverse = np.unique(key, return_inverse=True)
+        self.discount, rest = np.divmod(groups, self.cities * self.genders)
+        self.city, self.gender = np.divmod(rest, self.genders)
+
+        # Entries are keyed group * span + day offset; cents and counts hold the running totals before each entry
+        day = facts["day"].astype(np.int64)
+        self.first_day = int(day.min(initial=0))
+        self.span = int(day.max(initial=0)) - self.first_day + 1
+        self.keys, entry = np.unique(inverse * self.span + day - self.first_day, return_inverse=True)
+        cents = np.zeros(len(self.keys), dtype=np.int64)
+        np.add.at(cents, entry, facts["cents"])
+        self.cents = np.concatenate([[0], np.cumsum(cents)])
+        self.counts = np.concatenate([[0], np.cumsum(np.bincount(entry, minlength=len(self.keys)))])
+
+        self.entries = np.searchsorted(self.keys, np.arange(len(groups)) * self.span)  # First entry of each group
+        self.first = self.keys[self.entries] % self.span + self.first_day
+        self.last = self.keys[np.append(self.entries[1:], len(self.keys)) - 1] % self.span + self.first_day
+
+    def nbytes(self):
+        return self.keys.nbytes + self.cents.nbytes + self.counts.nbytes
+
+    def select(self, discounted=False, city_id=None, gender_code=None):
+        """Indexes of the groups matching the filters; gender_code is a SalesSnapshot gender code."""
+        keep = np.ones(len(self.first), dtype=bool)
+        if discounted:
+            keep &= self.discount > 0
+        if city_id is not None:
+            keep &= self.city == city_id
+        if gender_code is not None:
+            keep &= self.gender == gender_code + 1
+        return np.flatnonzero(keep)
+
+    def _through(self, groups, days):
+        # Running totals of each group up to and including the matching day
+        offsets = np.clip(days - self.first_day, -1, self.span - 1)
+        index, start = np.searchsorted(self.keys, groups * self.span + offsets, side="right"), self.entries[groups]
+        return self.cents[index] - self.cents[start], self.counts[index] - self.counts[start]
+
+    def range_totals(self, groups, range_starts, range_ends):
+        """Cents and sale counts of each group in each day range, for the (group, range) pairs that overlap.
+
+        range_starts and range_ends are sorted, non-overlapping day numbers. Returns (group, range, cents,
+        counts) arrays, one entry per overlapping pair, so the work is two binary searches per group and range.
+        """
+        first = np.searchsorted(range_ends, self.first[groups], side="left")
+        stop = np.searchsorted(range_starts, self.last[groups], side="right")
+        pairs = np.maximum(stop - first, 0)
+        pair_group = np.repeat(groups, pairs)
+        pair_range = np.repeat(first, pairs) + np.arange(pairs.sum()) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+
+        cents_end, counts_end = self._through(pair_group, range_ends[pair_range])
+        cents_start, counts_start = self._through(pair_group, range_starts[pair_range] - 1)
+        return pair_group, pair_range, cents_end - cents_start, counts_end - counts_start
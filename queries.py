@@ -0,0 +1,380 @@
+import db
+import metrics
+
+# Every endpoint query is one of the canonical statements below. Placeholders are written as {name} and
+# numbered $1, $2, ... in order of first appearance, and optional filters take the form
+# ({name} IS NULL OR ...), so each statement has a single SQL text whatever filters a request uses.
+# A statement is prepared once per pooled connection and reused from then on: asyncpg keeps it in the
+# connection's statement cache (sized in db.py), keyed on the SQL text. PreparedStatement objects themselves
+# cannot be held on to, since asyncpg invalidates them whenever their connection goes back to the pool.
+
+_hits = 0  # Statements run from asyncpg's statement cache
+_misses = 0  # Statements that had to be prepared first
+
+
+class _Slots(dict):
+    """Numbers placeholders in order of first appearance."""
+
+    def __missing__(self, name):
+        self[name] = f"${len(self) + 1}"
+        return self[name]
+
+
+class Statement:
+    """A named SQL statement with named parameters; missing parameters are bound as NULL."""
+
+    def __init__(self, name, template):
+        slots = _Slots()
+        self.name = name
+        self.sql = template.format_map(slots)
+        self.params = list(slots)
+
+    def args(self, values):
+        return [values.get(name) for name in self.params]
+
+
+STATEMENTS = {}
+
+
+def statement(name, template):
+    """Register a canonical statement."""
+    if name in STATEMENTS:
+        raise ValueError(f"Statement {name} is already registered")
+    STATEMENTS[name] = Statement(name, template)
+    return STATEMENTS[name]
+
+
+def filter_value(value):
+    """A request filter as a parameter: "All", blanks and 0 (no category) become NULL, which matches every row."""
+    if value is None or value == 0 or (isinstance(value, str) and value.strip().lower() in ("", "all")):
+        return None
+    return value
+
+
+def _track(connection, statement):
+    """Count whether asyncpg will run statement from the connection's statement cache or prepare it first."""
+    global _hits, _misses
+    try:
+        # asyncpg has no public lookup; its cache is keyed on (SQL, record class, ignore_custom_codec)
+        cached = connection._stmt_cache.has((statement.sql, connection._protocol.get_record_class(), False))
+    except AttributeError:
+        return
+    if cached:
+        _hits += 1
+    else:
+        _misses += 1
+
+
+async def _fetch(connection, statement, values):
+    _track(connection, statement)
+    return await connection.fetch(statement.sql, *statement.args(values))
+
+
+async def _fetchval(connection, statement, values):
+    _track(connection, statement)
+    return await connection.fetchval(statement.sql, *statement.args(values))
+
+
+async def fetch(statement, **values):
+    with metrics.stage("db"):
+        rows = await db.run(_fetch, statement, values)
+    metrics.count_rows(statement.name, len(rows))
+    return rows
+
+
+async def fetchval(statement, **values):
+    with metrics.stage("db"):
+        value = await db.run(_fetchval, statement, values)
+    metrics.count_rows(statement.name, 0 if value is None else 1)
+    return value
+
+
+def iterate(statement, batch_size=db.CURSOR_BATCH_SIZE, **values):
+    """Blocking generator over cursor batches of a statement, for streamed response bodies."""
+    return db.iterate(statement.sql, *statement.args(values), batch_size=batch_size)
+
+
+def batches(statement, batch_size=db.CURSOR_BATCH_SIZE, **values):
+    """Async generator over cursor batches of a statement; it has to run on the loop that owns the pool."""
+    return db.cursor_batches(statement.sql, *statement.args(values), batch_size=batch_size)
+
+
+def stats():
+    lookups = _hits + _misses
+    return {
+        "statements": len(STATEMENTS),
+        "cache_size": db.STATEMENT_CACHE_SIZE,
+        "hits": _hits,
+        "misses": _misses,
+        "hit_rate": round(_hits / lookups, 4) if lookups else 0.0,
+    }
+
+
+CATEGORIES = statement("categories", "SELECT category_id, category_name FROM categories ORDER BY category_name;")
+
+# Optional filters on the clients joined as cl
+CLIENT_FILTERS = """
+    AND ({gender}::TEXT IS NULL OR cl.gender = {gender})
+    AND ({min_age}::NUMERIC IS NULL OR cl.age >= {min_age})
+    AND ({max_age}::NUMERIC IS NULL OR cl.age <= {max_age})
+"""
+
+
+# Sales per period and discount (fetch-sales-trend)
+DISCOUNT_SALES = statement("discount_sales", """
+    SELECT
+        DATE_TRUNC({unit}, s.sale_date) AS period,
+        d.discount_name,
+        d.discount_rate,
+        SUM(s.total_price) AS total_sales
+    FROM sales s
+    LEFT JOIN discounts d ON s.discount_id = d.discount_id
+    LEFT JOIN clients cl ON s.client_id = cl.client_id
+    LEFT JOIN cities ci ON s.city_id = ci.city_id
+    WHERE s.sale_date BETWEEN {start_date} AND {end_date} AND s.discount_id IS NOT NULL
+""" + CLIENT_FILTERS + """
+    AND ({city}::TEXT IS NULL OR ci.city_name = {city})
+    GROUP BY period, d.discount_name, d.discount_rate
+    ORDER BY period, d.discount_name;
+""")
+
+# Total sales per period (export-sales)
+PERIOD_SALES = statement("period_sales", """
+    SELECT
+        DATE_TRUNC({unit}, s.sale_date) AS period,
+        SUM(s.total_price) AS total_sales
+    FROM sales s
+    LEFT JOIN clients cl ON s.client_id = cl.client_id
+    LEFT JOIN cities ci ON s.city_id = ci.city_id
+    WHERE s.sale_date BETWEEN {start_date} AND {end_date}
+""" + CLIENT_FILTERS + """
+    AND ({city}::TEXT IS NULL OR ci.city_name = {city})
+    GROUP BY period
+    ORDER BY period;
+""")
+
+# Raw sales rows in (sale_date, sale_id) order, optionally after a keyset cursor and limited (fetch-sales, export-sales-data)
+SALES_ROWS = statement("sales_rows", """
+    SELECT
+        s.sale_id, b.title, ag.age_group_name, ag.description, cl.age, cl.gender, s.sale_date, s.quantity,
+        s.total_price AS total_sales, cat.category_name, ci.city_name
+    FROM sales s
+    LEFT JOIN clients cl ON s.client_id = cl.client_id
+    LEFT JOIN age_groups ag ON cl.age_group_id = ag.age_group_id
+    LEFT JOIN books b ON s.book_id = b.book_id
+    LEFT JOIN subcategories sub ON b.subcategory_id = sub.subcategory_id
+    LEFT JOIN categories cat ON sub.category_id = cat.category_id
+    LEFT JOIN cities ci ON s.city_id = ci.city_id
+    WHERE s.sale_date BETWEEN {start_date} AND {end_date}
+""" + CLIENT_FILTERS + """
+    AND ({city}::TEXT IS NULL OR ci.city_name = {city})
+    AND ({after_date}::DATE IS NULL OR (s.sale_date, s.sale_id) > ({after_date}, {after_id}::INT))
+    ORDER BY s.sale_date, s.sale_id
+    LIMIT {limit}::BIGINT;
+""")
+
+# Number of sales per subcategory (subcategory-series, export-subcategory-bar-chart)
+SUBCATEGORY_SALES = statement("subcategory_sales", """
+    SELECT
+        sub.subcategory_name AS subcategory_name,
+        COUNT(s.sale_id) AS total_sales
+    FROM sales s
+    INNER JOIN books b ON s.book_id = b.book_id
+    INNER JOIN subcategories sub ON b.subcategory_id = sub.subcategory_id
+    INNER JOIN categories cat ON sub.category_id = cat.category_id
+    INNER JOIN clients cl ON s.client_id = cl.client_id
+    WHERE s.sale_date BETWEEN {start_date} AND {end_date}
+""" + CLIENT_FILTERS + """
+    AND ({category}::INT IS NULL OR cat.category_id = {category})
+    GROUP BY sub.subcategory_name
+    ORDER BY sub.subcategory_name;
+""")
+
+# Sales per event that started in the range (fetch-event-sales, export-event-sales)
+EVENT_SALES = statement("event_sales", """
+    SELECT
+        e.event_name,
+        cat.category_name AS category_name,
+        e.start_date,
+        e.end_date,
+        CAST(e.end_date - e.start_date AS INTEGER) + 1 AS duration,
+        SUM(s.quantity) AS total_quantity_sold,
+        SUM(s.total_price) AS total_sales,
+        COUNT(DISTINCT s.book_id) AS unique_books_sold,
+
+        CASE
+            WHEN (e.end_date - e.start_date) > 0
+            THEN SUM(s.total_price) / (e.end_date - e.start_date)
+            ELSE SUM(s.total_price)
+        END AS average_sales_per_day,
+
+        CASE
+            WHEN (e.end_date - e.start_date) > 0
+            THEN SUM(s.quantity) / (e.end_date - e.start_date)
+            ELSE SUM(s.quantity)
+        END AS average_books_sold_per_day
+    FROM events e
+    LEFT JOIN sales s ON s.event_id = e.event_id
+    INNER JOIN clients cl ON s.client_id = cl.client_id
+    INNER JOIN books b ON b.book_id = s.book_id
+    INNER JOIN subcategories sub ON b.subcategory_id = sub.subcategory_id
+    LEFT JOIN categories cat ON sub.category_id = cat.category_id
+    WHERE e.start_date BETWEEN {start_date} AND {end_date}
+        AND ({category}::INT IS NULL OR cat.category_id = {category})
+        AND ({gender}::TEXT IS NULL OR cl.gender = {gender})
+    GROUP BY e.event_id, e.start_date, e.end_date, category_name
+    ORDER BY e.start_date;
+""")
+
+
+# Per-city totals with gender and age group percentages, as one JSON object keyed by city name.
+# groups_template yields one row per city, gender and age group; numeric values are rendered as
+# strings, like the Decimal values jsonify used to produce. Returns a statement template.
+def city_summary_template(groups_template):
+    return f"""
+        WITH city_groups AS ({groups_template}),
+        city_totals AS (
+            SELECT
+                city_name,
+                latitude,
+                longitude,
+                SUM(total_sales) AS total_sales,
+                SUM(transaction_count) AS transaction_count,
+                MIN(min_sale) AS min_sale,
+                MAX(max_sale) AS max_sale
+            FROM city_groups
+            GROUP BY city_name, latitude, longitude
+        ),
+        city_genders AS (
+            SELECT city_name, gender, SUM(group_count) AS group_count
+            FROM city_groups
+            GROUP BY city_name, gender
+        ),
+        city_ages AS (
+            SELECT city_name, age_group || ' (' || age_group_description || ')' AS age_group, SUM(group_count) AS group_count
+            FROM city_groups
+            GROUP BY 1, 2
+        )
+        SELECT COALESCE(json_object_agg(COALESCE(t.city_name, 'null'), json_build_object(
+            'latitude', t.latitude::TEXT,
+            'longitude', t.longitude::TEXT,
+            'total_sales', t.total_sales::TEXT,
+            'transaction_count', t.transaction_count,
+            'average_sale', (t.total_sales / t.transaction_count)::TEXT,
+            'min_sale', t.min_sale::TEXT,
+            'max_sale', t.max_sale::TEXT,
+            'gender_breakdown', (
+                SELECT json_object_agg(g.gender, ROUND(g.group_count * 100.0 / t.transaction_count, 2) ORDER BY g.gender)
+                FROM city_genders g
+                WHERE g.city_name IS NOT DISTINCT FROM t.city_name
+            ),
+            'age_group_distribution', (
+                SELECT json_object_agg(a.age_group, ROUND(a.group_count * 100.0 / t.transaction_count, 2) ORDER BY a.age_group)
+                FROM city_ages a
+                WHERE a.city_name IS NOT DISTINCT FROM t.city_name
+            )
+        ) ORDER BY t.city_name), '{{{{}}}}')::TEXT
+        FROM city_totals t;
+    """
+
+
+# Sales per city, gender and age group (cities)
+CITY_SALES_GROUPS = """
+    SELECT
+        c.city_name,
+        c.latitude,
+        c.longitude,
+        SUM(s.total_price) AS total_sales,
+        COUNT(s.sale_id) AS transaction_count,
+        MIN(s.total_price) AS min_sale,
+        MAX(s.total_price) AS max_sale,
+        COALESCE(cl.gender, 'Unknown') AS gender,
+        COALESCE(ag.age_group_name, 'Unknown') AS age_group,
+        COALESCE(ag.description, 'Unknown') AS age_group_description,
+        COUNT(*) AS group_count
+    FROM sales s
+    LEFT JOIN clients cl ON s.client_id = cl.client_id
+    LEFT JOIN age_groups ag ON cl.age_group_id = ag.age_group_id
+    LEFT JOIN cities c ON s.city_id = c.city_id
+    INNER JOIN books b ON s.book_id = b.book_id
+    INNER JOIN subcategories sub ON b.subcategory_id = sub.subcategory_id
+    INNER JOIN categories cat ON sub.category_id = cat.category_id
+    WHERE s.sale_date BETWEEN {start_date} AND {end_date}
+""" + CLIENT_FILTERS + """
+    AND ({category}::INT IS NULL OR cat.category_id = {category})
+    GROUP BY c.city_id, c.city_name, c.latitude, c.longitude, cl.gender, ag.age_group_name, ag.description
+"""
+
+CITY_SUMMARY = statement("city_summary", city_summary_template(CITY_SALES_GROUPS))
+
+
+# The same results read from sales_daily_rollup (see rollup.can_answer); it has no ages to filter on
+
+ROLLUP_DISCOUNT_SALES = statement("rollup_discount_sales", """
+    SELECT
+        DATE_TRUNC({unit}, r.day) AS period,
+        d.discount_name,
+        d.discount_rate,
+        SUM(r.total_price) AS total_sales
+    FROM sales_daily_rollup r
+    INNER JOIN discounts d ON r.discount_id = d.discount_id
+    LEFT JOIN cities ci ON r.city_id = ci.city_id
+    WHERE r.day BETWEEN {start_date} AND {end_date}
+        AND ({gender}::TEXT IS NULL OR r.gender = {gender})
+        AND ({city}::TEXT IS NULL OR ci.city_name = {city})
+    GROUP BY period, d.discount_name, d.discount_rate
+    ORDER BY period, d.discount_name;
+""")
+
+ROLLUP_PERIOD_SALES = statement("rollup_period_sales", """
+    SELECT
+        DATE_TRUNC({unit}, r.day) AS period,
+        SUM(r.total_price) AS total_sales
+    FROM sales_daily_rollup r
+    LEFT JOIN cities ci ON r.city_id = ci.city_id
+    WHERE r.day BETWEEN {start_date} AND {end_date}
+        AND ({gender}::TEXT IS NULL OR r.gender = {gender})
+        AND ({city}::TEXT IS NULL OR ci.city_name = {city})
+    GROUP BY period
+    ORDER BY period;
+""")
+
+ROLLUP_SUBCATEGORY_SALES = statement("rollup_subcategory_sales", """
+    SELECT
+        sub.subcategory_name AS subcategory_name,
+        SUM(r.sale_count)::BIGINT AS total_sales
+    FROM sales_daily_rollup r
+    INNER JOIN subcategories sub ON r.subcategory_id = sub.subcategory_id
+    INNER JOIN categories cat ON sub.category_id = cat.category_id
+    WHERE r.day BETWEEN {start_date} AND {end_date} AND r.has_client
+        AND ({gender}::TEXT IS NULL OR r.gender = {gender})
+        AND ({category}::INT IS NULL OR cat.category_id = {category})
+    GROUP BY sub.subcategory_name
+    ORDER BY sub.subcategory_name;
+""")
+
+ROLLUP_CITY_SALES_GROUPS = """
+    SELECT
+        c.city_name,
+        c.latitude,
+        c.longitude,
+        SUM(r.total_price) AS total_sales,
+        SUM(r.sale_count)::BIGINT AS transaction_count,
+        MIN(r.min_price) AS min_sale,
+        MAX(r.max_price) AS max_sale,
+        COALESCE(NULLIF(r.gender, ''), 'Unknown') AS gender,
+        COALESCE(ag.age_group_name, 'Unknown') AS age_group,
+        COALESCE(ag.description, 'Unknown') AS age_group_description,
+        SUM(r.sale_count)::BIGINT AS group_count
+    FROM sales_daily_rollup r
+    LEFT JOIN age_groups ag ON r.age_group_id = ag.age_group_id
+    LEFT JOIN cities c ON r.city_id = c.city_id
+    INNER JOIN subcategories sub ON r.subcategory_id = sub.subcategory_id
+    INNER JOIN categories cat ON sub.category_id = cat.category_id
+    WHERE r.day BETWEEN {start_date} AND {end_date}
+        AND ({gender}::TEXT IS NULL OR r.gender = {gender})
+        AND ({category}::INT IS NULL OR cat.category_id = {category})
+    GROUP BY c.city_id, c.city_name, c.latitude, c.longitude, r.gender, ag.age_group_name, ag.description
+"""
+
+ROLLUP_CITY_SUMMARY = statement("rollup_city_summary", city_summary_template(ROLLUP_CITY_SALES_GROUPS))
@@ -1,8 +1,12 @@
+import argparse
 import asyncpg
 import random
 import asyncio
 
-async def update_sales_with_random_cities():
+# Sales are updated in chunks of this many rows, each chunk in its own transaction
+CHUNK_SIZE = 50_000
+
+async def update_sales_with_random_cities(seed=None, chunk_size=CHUNK_SIZE):
     # Connect to your PostgreSQL database
     conn = await asyncpg.connect(
         user='postgres',
@@ -12,26 +16,61 @@ async def update_sales_with_random_cities():
         port='5432'        # Default PostgreSQL port
     )
 
-    # Step 1: Fetch all city IDs from the cities table
-    city_ids = await conn.fetch('SELECT city_id FROM cities;')
-    city_ids = [city['city_id'] for city in city_ids]
+    try:
+        # The rollup triggers would rebuild every touched day after each chunk, so it is rebuilt once at the end
+        await conn.execute("SET sales_rollup.deferred = 'on';")
+
+        # Step 1: Fetch all city IDs from the cities table
+        city_ids = await conn.fetch('SELECT city_id FROM cities ORDER BY city_id;')
+        city_ids = [city['city_id'] for city in city_ids]
+
+        # Same seed and same sales give the same assignment
+        rng = random.Random(seed)
+        last_sale_id = 0
+        updated = 0
+
+        while True:
+            # Step 2: Fetch the next chunk of sale IDs in sale_id order (all of them when chunk_size is 0)
+            if chunk_size:
+                sales_ids = await conn.fetch(
+                    'SELECT sale_id FROM sales WHERE sale_id > $1 ORDER BY sale_id LIMIT $2;',
+                    last_sale_id, chunk_size
+                )
+            else:
+                sales_ids = await conn.fetch('SELECT sale_id FROM sales ORDER BY sale_id;')
+            sales_ids = [sale['sale_id'] for sale in sales_ids]
+            if not sales_ids:
+                break
 
-    # Step 2: Fetch all sale IDs from the sales table
-    sales_ids = await conn.fetch('SELECT sale_id FROM sales;')
-    sales_ids = [sale['sale_id'] for sale in sales_ids]
+            # Step 3: Update the whole chunk with random city_ids in a single statement
+            random_city_ids = [rng.choice(city_ids) for _ in sales_ids]
+            await conn.execute(
+                '''
+                UPDATE sales SET city_id = chunk.city_id
+                FROM unnest($1::int[], $2::int[]) AS chunk(sale_id, city_id)
+                WHERE sales.sale_id = chunk.sale_id;
+                ''',
+                sales_ids, random_city_ids
+            )
 
-    # Step 3: Update sales records with random city_id
-    for sale_id in sales_ids:
-        random_city_id = random.choice(city_ids)
-        await conn.execute(
-            'UPDATE sales SET city_id = $1 WHERE sale_id = $2;',
-            random_city_id, sale_id
-        )
+            updated += len(sales_ids)
+            last_sale_id = sales_ids[-1]
+            print(f"Updated {updated} sales (up to sale_id {last_sale_id}).")
+            if not chunk_size:
+                break
 
-    # Close the connection
-    await conn.close()
+        if await conn.fetchval("SELECT to_regclass('sales_daily_rollup') IS NOT NULL;"):
+            await conn.execute("SELECT refresh_sales_rollup(MIN(sale_date), MAX(sale_date)) FROM sales;")
+    finally:
+        # Close the connection
+        await conn.close()
 
     print("Sales records updated with random cities successfully.")
 
 # Run the asynchronous function
-asyncio.run(update_sales_with_random_cities())
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assign every sale a uniformly random city.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for a reproducible assignment")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Sales per UPDATE (0 updates all at once)")
+    args = parser.parse_args()
+    asyncio.run(update_sales_with_random_cities(args.seed, args.chunk_size))
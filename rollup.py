@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import logging
+import os
+from datetime import date
+
+import db
+
+# The rollup is read whenever a request can be answered from it; set SALES_ROLLUP=off to always scan sales
+ROLLUP_ENABLED = os.getenv("SALES_ROLLUP", "on").lower() != "off"
+
+_available = None
+
+
+async def is_available():
+    """Check once per process whether migrations 0004_sales_daily_rollup and 0006 (its has_client key) have been applied."""
+    global _available
+    if _available is None:
+        _available = await db.fetchval("""
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'sales_daily_rollup' AND column_name = 'has_client'
+            );
+        """)
+        logging.debug(f"Sales rollup available: {_available}")
+    return _available
+
+
+async def can_answer(min_age=None, max_age=None):
+    """The rollup keeps age groups rather than ages, so age range filters need the sales table."""
+    if not ROLLUP_ENABLED or min_age is not None or max_age is not None:
+        return False
+    return await is_available()
+
+
+async def refresh(start_date=None, end_date=None):
+    """Rebuild the rollup for a date range (the whole sales table by default)."""
+    bounds = await db.fetchrow("SELECT MIN(sale_date) AS first_day, MAX(sale_date) AS last_day FROM sales;")
+    start_date = start_date or bounds["first_day"]
+    end_date = end_date or bounds["last_day"]
+    if start_date is None or end_date is None:
+        print("No sales to roll up.")
+        return
+    await db.execute("SELECT refresh_sales_rollup($1, $2);", start_date, end_date)
+    print(f"Sales rollup refreshed from {start_date} to {end_date}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the daily sales rollup table.")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day to rebuild (YYYY-MM-DD)")
+    args = parser.parse_args()
+    asyncio.run(refresh(args.start, args.end))
@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+
+# Bumped whenever the layout below changes; snapshots in another format are ignored
+SNAPSHOT_FORMAT = 3
+MANIFEST = "manifest.json"
+DIMENSIONS = "dimensions.json"
+
+# A snapshot directory holds one version directory per write, each with a .npy file per sales column
+# (mapped read-only, so every worker shares the same pages) and the dimension tables as JSON. manifest.json
+# names the current version and is replaced atomically once that version is complete. Its rows, cents and
+# last_sale_id describe the sales held, so readers can tell whether Postgres still has the same ones.
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__} in a snapshot")
+
+
+def _decode(value):
+    if "$decimal" in value:
+        return Decimal(value["$decimal"])
+    if "$date" in value:
+        return date.fromisoformat(value["$date"])
+    return value
+
+
+def read_manifest(directory):
+    """The manifest of the current snapshot in directory, or None when there is no usable one."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        logging.warning(f"Ignoring sales snapshot in {directory}: format {manifest.get('format')}, expected {SNAPSHOT_FORMAT}")
+        return None
+    return manifest
+
+
+def open_snapshot(directory, manifest):
+    """Map the columns of a snapshot read-only; return (facts, dimensions)."""
+    version = os.path.join(directory, manifest["version"])
+    facts = {}
+    for name, dtype in manifest["columns"].items():
+        column = np.load(os.path.join(version, f"{name}.npy"), mmap_mode="r")
+        if column.dtype != np.dtype(dtype) or len(column) != manifest["rows"]:
+            raise ValueError(f"Sales snapshot column {name} does not match its manifest")
+        facts[name] = column
+    with open(os.path.join(version, DIMENSIONS)) as dimensions_file:
+        dimensions = {
+            name: [tuple(row) for row in rows]
+            for name, rows in json.load(dimensions_file, object_hook=_decode).items()
+        }
+    return facts, dimensions
+
+
+def write_snapshot(directory, facts, dimensions):
+    """Write facts and dimensions as a new version, switch the manifest to it and drop older versions."""
+    rows = len(facts["sale_id"])
+    last_sale_id = int(facts["sale_id"][-1]) if rows else 0
+    version = f"v{SNAPSHOT_FORMAT}-{last_sale_id}-{int(time.time())}"
+    path = os.path.join(directory, version)
+    os.makedirs(path)
+
+    for name, column in facts.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(column))
+    with open(os.path.join(path, DIMENSIONS), "w") as dimensions_file:
+        json.dump(dimensions, dimensions_file, default=_encode)
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "rows": rows,
+        "last_sale_id": last_sale_id,
+        "cents": int(facts["cents"].sum()),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "columns": {name: column.dtype.str for name, column in facts.items()},
+    }
+    staging = os.path.join(directory, MANIFEST + ".tmp")
+    with open(staging, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(staging, os.path.join(directory, MANIFEST))
+
+    # Workers that still map an older version keep reading it; unlinked files stay valid while mapped
+    for entry in os.listdir(directory):
+        if entry != version and entry.startswith("v") and os.path.isdir(os.path.join(directory, entry)):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return manifest
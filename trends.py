@@ -0,0 +1,178 @@
+import hashlib
+import os
+
+import numpy as np
+
+from cache import LRUCache
+from fitting import (
+    CLOSED_FORM,
+    exponential_func,
+    fit_exponential,
+    fit_logarithmic,
+    fit_power_law,
+    lstsq_batch,
+    series_mask,
+)
+
+TREND_TYPES = ("linear", "exponential", "polynomial", "logarithmic", "power-law", "moving_average")
+
+# Fitted models are keyed on the series itself, so they never go stale and need no TTL
+MODEL_CACHE_ENABLED = os.getenv("TREND_MODEL_CACHE", "on").lower() != "off"
+MODEL_CACHE_MAX_BYTES = int(os.getenv("TREND_MODEL_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+_model_cache = LRUCache(max_bytes=MODEL_CACHE_MAX_BYTES, ttl=None)
+
+
+class TrendFit:
+    """Fitted parameters for a batch of series, which can be evaluated for any prediction horizon.
+
+    params holds one row per series: polynomial coefficients (highest power
+    first, in x scaled by `scales`), (a, b) for logarithmic and power-law,
+    (a, b, c) for exponential, or the smoothed series for moving_average.
+    methods records how each series was fitted (see fitting.py).
+    """
+
+    def __init__(self, trend_type, lengths, params, methods, scales=None):
+        self.trend_type = trend_type
+        self.lengths = lengths
+        self.params = params
+        self.methods = methods
+        self.scales = scales
+
+
+def pad_series(series):
+    """Stack series of different lengths into a zero-padded 2-D array plus their lengths."""
+    lengths = np.array([len(values) for values in series], dtype=np.int64)
+    y = np.zeros((len(series), lengths.max(initial=0)))
+    for i, values in enumerate(series):
+        y[i, :lengths[i]] = values
+    return y, lengths
+
+
+def _fit_polynomial(y, lengths, degree):
+    """Polynomial least squares for the whole batch in one solve, with x scaled into [0, 1] per series."""
+    width = y.shape[1]
+    scales = np.maximum(lengths - 1, 1).astype(float)
+    t = np.arange(width)[None, :] / scales[:, None]
+    design = t[:, :, None] ** np.arange(degree, -1, -1)
+    return lstsq_batch(design, y, series_mask(lengths, width)), scales
+
+
+def _moving_average(y, lengths, window_size=3):
+    """Centered moving average per row, zero-padded at the edges like np.convolve(mode="same")."""
+    masked = np.where(series_mask(lengths, y.shape[1]), y, 0.0)
+    padded = np.pad(masked, ((0, 0), (window_size // 2, window_size - 1 - window_size // 2)))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window_size, axis=1)
+    return windows.mean(axis=2)
+
+
+def fit_trends(y, lengths, trend_type):
+    """Fit one trend per row of a padded 2-D array of series."""
+    y = np.asarray(y, dtype=float)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    batch = len(lengths)
+
+    if trend_type in ("linear", "polynomial"):
+        params, scales = _fit_polynomial(y, lengths, 1 if trend_type == "linear" else 2)
+        return TrendFit(trend_type, lengths, params, [CLOSED_FORM] * batch, scales)
+    if trend_type == "moving_average":
+        return TrendFit(trend_type, lengths, _moving_average(y, lengths), [CLOSED_FORM] * batch)
+    if trend_type == "logarithmic":
+        return TrendFit(trend_type, lengths, *fit_logarithmic(y, lengths))
+    if trend_type == "power-law":
+        return TrendFit(trend_type, lengths, *fit_power_law(y, lengths))
+    if trend_type == "exponential":
+        return TrendFit(trend_type, lengths, *fit_exponential(y, lengths))
+    raise ValueError(f"Invalid trendType: {trend_type}")
+
+
+def model_key(values, trend_type, frequency=None):
+    """Fingerprint of one series plus how it is fitted."""
+    digest = hashlib.blake2b(np.ascontiguousarray(values, dtype=float).tobytes(), digest_size=16).hexdigest()
+    return f"{trend_type}:{frequency}:{len(values)}:{digest}"
+
+
+def fit_trends_cached(y, lengths, trend_type, frequency=None):
+    """fit_trends that reuses the fitted parameters of series seen before; only new series are fitted."""
+    y = np.asarray(y, dtype=float)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if not MODEL_CACHE_ENABLED:
+        return fit_trends(y, lengths, trend_type)
+
+    keys = [model_key(y[i, :lengths[i]], trend_type, frequency) for i in range(len(lengths))]
+    models = [_model_cache.get(key) for key in keys]
+    missing = [i for i, model in enumerate(models) if model is None]
+
+    if missing:
+        fitted = fit_trends(y[missing], lengths[missing], trend_type)
+        for j, i in enumerate(missing):
+            row = fitted.params[j]
+            if trend_type == "moving_average":
+                row = row[:lengths[i]]
+            scale = None if fitted.scales is None else fitted.scales[j]
+            models[i] = (row.copy(), fitted.methods[j], scale)
+            _model_cache.set(keys[i], models[i], models[i][0].nbytes + len(keys[i]))
+
+    if trend_type == "moving_average":
+        params = np.zeros((len(lengths), y.shape[1]))
+        for i, (row, _, _) in enumerate(models):
+            params[i, :len(row)] = row
+    else:
+        params = np.array([row for row, _, _ in models]).reshape(len(lengths), -1)
+    scales = None if trend_type not in ("linear", "polynomial") else np.array([scale for _, _, scale in models], dtype=float)
+    return TrendFit(trend_type, lengths, params, [method for _, method, _ in models], scales)
+
+
+def model_cache_stats():
+    return _model_cache.stats()
+
+
+def evaluate_trends(fit, prediction_points):
+    """Evaluate fitted trends over the observed points and the prediction horizon.
+
+    Returns (trend_lines, future_trends): trend_lines[i, :lengths[i]] is the
+    fitted curve over the observed points and future_trends[i, :lengths[i] +
+    prediction_points] extends it over the prediction horizon. Cells past
+    those lengths are NaN.
+    """
+    lengths = fit.lengths
+    batch = len(lengths)
+    width = int(lengths.max(initial=0))
+    future_width = width + prediction_points
+    x = np.arange(future_width, dtype=float)[None, :]
+    params = fit.params
+
+    if fit.trend_type in ("linear", "polynomial"):
+        t = x / fit.scales[:, None]
+        powers = np.arange(params.shape[1] - 1, -1, -1)
+        future_trends = np.einsum("bk,blk->bl", params, t[:, :, None] ** powers)
+    elif fit.trend_type == "moving_average":
+        # The future repeats the last smoothed value
+        last = params[np.arange(batch), np.maximum(lengths - 1, 0)]
+        future_trends = np.repeat(last[:, None], future_width, axis=1)
+        future_trends[:, :width] = np.where(series_mask(lengths, width), params[:, :width], last[:, None])
+    elif fit.trend_type == "logarithmic":
+        future_trends = params[:, :1] * np.log(x + 1) + params[:, 1:2]
+    elif fit.trend_type == "power-law":
+        future_trends = params[:, :1] * (x + 1) ** params[:, 1:2]
+    else:
+        future_trends = exponential_func(x, params[:, :1], params[:, 1:2], params[:, 2:3])
+
+    future_trends = np.array(future_trends, dtype=float).reshape(batch, future_width)
+    trend_lines = future_trends[:, :width].copy()
+    trend_lines[~series_mask(lengths, width)] = np.nan
+    future_trends[~series_mask(lengths + prediction_points, future_width)] = np.nan
+    return trend_lines, future_trends
+
+
+def batch_trends(y, lengths, trend_type, prediction_points, frequency=None):
+    """Fit (or reuse cached fits) and evaluate one trend per row; see evaluate_trends for the returned arrays."""
+    return evaluate_trends(fit_trends_cached(y, lengths, trend_type, frequency), prediction_points)
+
+
+#2. Trend calculation for different types
+def calculate_trend(x_data, y_data, trend_type, prediction_points, frequency=None):
+    """Calculate trend line and future predictions for a single series (x_data is 0..n-1)."""
+    y, lengths = pad_series([y_data])
+    trend_lines, future_trends = batch_trends(y, lengths, trend_type, prediction_points, frequency)
+    return trend_lines[0, :lengths[0]], future_trends[0, :lengths[0] + prediction_points]